@@ -51,6 +51,12 @@ if saveDatasheets:
     # Assumes there is only one default project per library
     myProject = myLibrary.projects(name = "Definitions")
 
+    # Datasheets are staged, checked and saved one by one at the end
+    definitionsWriter = DatasheetWriter(myLibrary)
+else:
+    myProject = None
+    definitionsWriter = None
+
 # Set local variables
 TreeCoverLabel = "Forest"
 WetlandLabel = "Wetland"
@@ -67,14 +73,14 @@ myDatasheet = pd.DataFrame({"AmountLabel": ["Area"],
                             "TertiaryStratumLabel": None,
                             "TimestepUnits": ["Year"]})
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # ST-Sim Strata ----
 datasheetName = "stsim_Stratum"
 myDatasheet = pd.DataFrame({"Name": [PRIMARY_STRATUM_VALUE],
                             "ID": [1]})
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # ST-Sim State Class ----
 datasheetName = "stsim_StateClass"
@@ -86,124 +92,131 @@ myStateClass = myStateClass[myStateClass.StateLabelXID.isin(modelsToInclude)].re
 datasheetName = "stsim_StateLabelX"
 myDatasheet = pd.DataFrame({"Name": myStateClass.StateLabelXID.unique()})
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # ST-Sim StateLabelY (Subclass) ----
 datasheetName = "stsim_StateLabelY"
 myDatasheet = pd.DataFrame({"Name": myStateClass.StateLabelYID.unique()})
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
-# ST-Sim State Class saved after StateLabelX and StateLabelY
+# ST-Sim State Class (saved after StateLabelX and StateLabelY by the writer)
 datasheetName = "stsim_StateClass"
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myStateClass,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # ST-Sim Transition Type ----
 datasheetName = "stsim_TransitionType"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR,
           datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # ST-Sim Transition Group ----
 datasheetName = "stsim_TransitionGroup"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, 
                           datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # ST-Sim Transition Types by Group ----
 datasheetName = "stsim_TransitionTypeGroup"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, 
                           datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # ST-Sim Age Types  ----
 datasheetName = "stsim_AgeType"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, 
                           datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # ST-Sim Age Groups ----
 datasheetName = "stsim_AgeGroup"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, 
                           datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # SF Stock Types ------------------------------------------------------------
 datasheetName = "stsimsf_StockType"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, 
                           datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)                                     
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)                                     
 
 # SF Stock Groups ------------------------------------------------------------
 datasheetName = "stsimsf_StockGroup"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, 
                           datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)  
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)  
 
 # SF Flow Types ------------------------------------------------------------
 datasheetName = "stsimsf_FlowType"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR) 
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter) 
 
 # SF Flow Groups ------------------------------------------------------------
 datasheetName = "stsimsf_FlowGroup"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)  
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)  
 
 # SF Terminology ------------------------------------------------------------
 datasheetName = "stsimsf_Terminology"
 myDatasheet = pd.DataFrame({"StockUnits": ["metric tons C"]})
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)  
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)  
 
 # ST-Sim Attribute Groups ------------------------------------------------------------
 datasheetName = "stsim_AttributeGroup"
 myDatasheet = pd.DataFrame({"Name": ["Carbon Initial Conditions", "NPP"]})
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)  
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)  
 
 # ST-Sim Attribute Types ------------------------------------------------------------
 datasheetName = "stsim_StateAttributeType"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # CBM Ecological Boundary ------------------------------------------------------------
 datasheetName = "stsimcbmcfs3_EcoBoundary"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # CBM Administrative Boundary ------------------------------------------------------------
 datasheetName = "stsimcbmcfs3_AdminBoundary"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # CBM Species Type  ------------------------------------------------------------
 datasheetName = "stsimcbmcfs3_SpeciesType"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # CBM Disturbance Type ------------------------------------------------------------
 datasheetName = "stsimcbmcfs3_DisturbanceType"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
 
 # CBM Stock  ------------------------------------------------------------
 datasheetName = "stsimcbmcfs3_CBMCFS3Stock"
 myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_CBM_DATA_DIR, datasheetName + ".csv"))
 finalize_datasheets(saveDatasheets, exportDatasheets, myProject, datasheetName, myDatasheet,
-                    folder=CUSTOM_DEF_CBM_SPINUP_DIR)
\ No newline at end of file
+                    folder=CUSTOM_DEF_CBM_SPINUP_DIR, writer=definitionsWriter)
+
+# Save all definitions to the library
+if saveDatasheets:
+    definitionsWriter.commit()
+
+# Wait for the csv exports, raising if any of them failed
+wait_for_exports()
@@ -143,3 +143,6 @@ finalize_datasheets(saveDatasheets,
                     myDatasheet, 
                     os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
                                  datasheetName))
+
+# Wait for the csv exports, raising if any of them failed
+wait_for_exports()
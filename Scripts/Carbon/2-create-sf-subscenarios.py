@@ -46,9 +46,9 @@ saveDatasheets = False # Set to True to save datasheet back to library
 exportDatasheets = True # Set to True to export datasheet as csv
 
 # Tabular data - Load from definitions
-stateAttributeTypes = pd.read_csv(os.path.join(CUSTOM_DEF_CBM_SPINUP_DIR,
+stateAttributeTypes = read_datasheet(os.path.join(CUSTOM_DEF_CBM_SPINUP_DIR,
                                                "stsim_StateAttributeType.csv"))
-stateClasses = pd.read_csv(os.path.join(CUSTOM_DEF_CBM_SPINUP_DIR,
+stateClasses = read_datasheet(os.path.join(CUSTOM_DEF_CBM_SPINUP_DIR,
                                         "stsim_StateClass.csv"))
 
 if saveDatasheets:
@@ -209,4 +209,7 @@ finalize_datasheets(saveDatasheets,
                     datasheetName,
                     myDatasheet, 
                     os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                                 datasheetName))
\ No newline at end of file
+                                 datasheetName))
+
+# Wait for the csv exports, raising if any of them failed
+wait_for_exports()
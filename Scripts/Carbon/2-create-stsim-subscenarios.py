@@ -76,4 +76,7 @@ finalize_datasheets(saveDatasheets,
                     datasheetName,
                     myDatasheet, 
                     os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                                 datasheetName))
\ No newline at end of file
+                                 datasheetName))
+
+# Wait for the csv exports, raising if any of them failed
+wait_for_exports()
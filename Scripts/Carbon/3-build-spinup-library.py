@@ -5,9 +5,12 @@
 ## This script loads definition and scenario data sheets saved as csvs
 ## into an st-simsf library
 ## It creates sub scenarios and full scenarios
+## With incrementalBuild, only datasheets whose csv changed since the
+## last build are saved again
 
 ## Workspace ----
 # Set up environment
+import glob
 import os
 import sys
 
@@ -37,163 +40,147 @@ WetlandLabel = "Wetland Forested"
 
 modelsToInclude = [TreeCoverLabel, WetlandLabel]
 
+incrementalBuild = False # Set to True to only save datasheets whose csv changed since the last build
+
 # Load session
 mySession = ps.Session()
 mySession.add_packages("stsim")
 mySession.add_packages("stsimsf")
 
+# The library is only rebuilt from scratch when it is not built incrementally
+libraryPath = os.path.join(LIBRARY_DIR, LIBRARY_FILE_NAME_BARE_LAND_SPINUP)
+incrementalBuild = incrementalBuild and os.path.exists(libraryPath)
+build = BuildManifest(os.path.join(CUSTOM_INTERMEDIATES_DIR,
+                                   os.path.splitext(LIBRARY_FILE_NAME_BARE_LAND_SPINUP)[0]
+                                   + "-build-manifest.json"),
+                      incremental=incrementalBuild, library_file=libraryPath)
+
 # Uses the default SyncroSim session
-myLibrary = ps.library(name = os.path.join(LIBRARY_DIR, LIBRARY_FILE_NAME_BARE_LAND_SPINUP),
+# The manifest turns off incremental builds if the library changed since
+myLibrary = ps.library(name = libraryPath,
     session = mySession, package = "stsim", addons = "stsimsf",
-    overwrite=True)
+    overwrite=not build.incremental)
 myLibrary.enable_addons("stsimcbmcfs3")
 
 # Configure the CBM database in the Library Properties
-cbm_db = myLibrary.datasheets(name = "stsimcbmcfs3_Database")
-cbm_db.loc[0, "Path"] = CBM_DBASE
-myLibrary.save_datasheet(name = "stsimcbmcfs3_Database", data = cbm_db)
+step, digest = "Library / stsimcbmcfs3_Database", build.digest(CBM_DBASE)
+if build.needs_build(step, digest):
+    cbm_db = myLibrary.datasheets(name = "stsimcbmcfs3_Database")
+    cbm_db.loc[0, "Path"] = CBM_DBASE
+    myLibrary.save_datasheet(name = "stsimcbmcfs3_Database", data = cbm_db)
+    build.built(step, digest)
     
 # Assumes there is only one default project per library
 myProject = myLibrary.projects(name = "Definitions")
 
 # Definitions ----
 # load all stsim and sf definition datasheets from definitions folder
-load_definitions(myProject, CUSTOM_DEF_CBM_SPINUP_DIR, cbmcfs3=True)
+step = "Definitions"
+digest = build.digest(*sorted(glob.glob(os.path.join(CUSTOM_DEF_CBM_SPINUP_DIR, "*.csv"))))
+if build.needs_build(step, digest):
+    load_definitions(myProject, CUSTOM_DEF_CBM_SPINUP_DIR, cbmcfs3=True)
+    build.built(step, digest)
 
 # Define the pipeline for each stage in CBM-CFS3
-scenarioName = "Pipeline - Load CBM-CFS3 Output"
-myScenario = myProject.scenarios(scenarioName)
-pipeline = myScenario.datasheets(name = "core_Pipeline")
-if (pipeline.empty):
-    stages = myProject.datasheets(name = "core_Transformer")
-    stage_name = stages[
-        stages.TransformerName == "stsimcbmcfs3_LoadCBMCFS3Output"
-        ].TransformerDisplayName.item()
-    pipeline = pd.concat([pipeline, pd.DataFrame({'StageNameID': [stage_name], "RunOrder": [1]})])
-    myScenario.save_datasheet(name = "core_Pipeline", data = pipeline)
-
-# Grab stage name from Project definitions
-scenarioName = "Pipeline - Generate Flow Multipliers"
-myScenario = myProject.scenarios(scenarioName)
-pipeline = myScenario.datasheets(name = "core_Pipeline")
-if (pipeline.empty):
-    stages = myProject.datasheets(name = "core_Transformer")
-    stage_name = stages[
-        stages.TransformerName == "stsimcbmcfs3_FlowPathways"
-        ].TransformerDisplayName.item()
-    pipeline = pd.concat([pipeline, pd.DataFrame({'StageNameID': [stage_name], "RunOrder": [1]})])
-    myScenario.save_datasheet(name = "core_Pipeline", data = pipeline)
-
-# Create folders for subscenarios and full scenarios
-subscenario_folder_id = create_project_folder(mySession, 
-                                              myLibrary,
-                                              myProject,
-                                              folder_name="Subscenarios")                                   
+for scenarioName, transformerName in [
+        ("Pipeline - Load CBM-CFS3 Output", "stsimcbmcfs3_LoadCBMCFS3Output"),
+        # Grab stage name from Project definitions
+        ("Pipeline - Generate Flow Multipliers", "stsimcbmcfs3_FlowPathways")]:
+    step, digest = scenarioName + " / core_Pipeline", build.digest(transformerName)
+    if not build.needs_build(step, digest):
+        continue
+    myScenario = myProject.scenarios(scenarioName)
+    pipeline = myScenario.datasheets(name = "core_Pipeline")
+    if (pipeline.empty):
+        stages = myProject.datasheets(name = "core_Transformer")
+        stage_name = stages[
+            stages.TransformerName == transformerName
+            ].TransformerDisplayName.item()
+        pipeline = pd.concat([pipeline, pd.DataFrame({'StageNameID': [stage_name], "RunOrder": [1]})])
+        myScenario.save_datasheet(name = "core_Pipeline", data = pipeline)
+    build.built(step, digest)
+
+# Create folders for subscenarios and full scenarios, or reuse them
+folders = folder_registry(mySession, myLibrary)
+if "Subscenarios" in folders.by_path:
+    subscenario_folder_id = folders.by_path["Subscenarios"]
+else:
+    subscenario_folder_id = create_project_folder(mySession, 
+                                                  myLibrary,
+                                                  myProject,
+                                                  folder_name="Subscenarios")                                   
+
+# Moves into folders are queued and run at the end, skipping scenarios
+# that are already in their folder
+folderMoves = FolderMoveQueue(mySession, myLibrary, myProject)
+
+def subscenario_csv(datasheetName, suffix=""):
+    return os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR, datasheetName,
+                        datasheetName + suffix + ".csv")
 
 # Subscenarios ----
 # Run Control
 # Run Control: Non-spatial 300 years, 1 MC
-scenarioName = "Run Control: Non-spatial, 300 yr, 1 MC"
-myScenario = myProject.scenarios(scenarioName)
-datasheetName = "stsim_RunControl"
-myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                          datasheetName, datasheetName + ".csv"))
-myScenario.save_datasheet(datasheetName, myDatasheet)
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, subscenario_folder_id)
+build_subscenario(build, myProject, "Run Control: Non-spatial, 300 yr, 1 MC",
+                  [("stsim_RunControl", subscenario_csv("stsim_RunControl"))],
+                  folderMoves, subscenario_folder_id)
 
 # SF Flow Pathways
 for model in modelsToInclude:
-    scenarioName = "SF Flow Pathways: " + model
-    myScenario = myProject.scenarios(scenarioName)
-    datasheetName = "stsimsf_FlowPathwayDiagram"
-    flowPathwayDiagram = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                                     datasheetName,
-                                     datasheetName + ".csv"))
-    myScenario.save_datasheet(datasheetName, flowPathwayDiagram)
-    datasheetName = "stsimsf_FlowPathway"
-    flowPathway = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                                datasheetName,
-                                datasheetName + "_" + model + ".csv"))
-    myScenario.save_datasheet(datasheetName, flowPathway)
-    add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, subscenario_folder_id)
+    build_subscenario(build, myProject, "SF Flow Pathways: " + model,
+                      [("stsimsf_FlowPathwayDiagram", subscenario_csv("stsimsf_FlowPathwayDiagram")),
+                       ("stsimsf_FlowPathway", subscenario_csv("stsimsf_FlowPathway", "_" + model))],
+                      folderMoves, subscenario_folder_id)
 
 # SF Initial Stocks -----------------------------
 # SF Initial Stocks Merged Model
-scenarioName = "SF Initial Stocks: Base"
-myScenario = myProject.scenarios(scenarioName)
-datasheetName = "stsimsf_InitialStockNonSpatial"
-myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                              datasheetName,
-                              datasheetName + ".csv"))
-myScenario.save_datasheet(datasheetName, myDatasheet)
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, subscenario_folder_id)
+build_subscenario(build, myProject, "SF Initial Stocks: Base",
+                  [("stsimsf_InitialStockNonSpatial", subscenario_csv("stsimsf_InitialStockNonSpatial"))],
+                  folderMoves, subscenario_folder_id)
 
 # SF Output Options -----------------------------
-scenarioName = "SF Output Options: Base - Summary Stock & Flow"
-myScenario = myProject.scenarios(scenarioName)
-datasheetName = "stsimsf_OutputOptions"
-myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                          datasheetName, datasheetName + ".csv"))
-myScenario.save_datasheet(datasheetName, myDatasheet)
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, subscenario_folder_id)
+build_subscenario(build, myProject, "SF Output Options: Base - Summary Stock & Flow",
+                  [("stsimsf_OutputOptions", subscenario_csv("stsimsf_OutputOptions"))],
+                  folderMoves, subscenario_folder_id)
 
 # SF Stock Group Membership -----------------------------
 # SF Stock Group Membership Merged Model
-scenarioName = "SF Stock Group Membership: Base"
-myScenario = myProject.scenarios(scenarioName)
-datasheetName = "stsimsf_StockTypeGroupMembership"
-myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                              datasheetName, datasheetName + ".csv"))
-myScenario.save_datasheet(datasheetName, myDatasheet)
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, subscenario_folder_id)
+build_subscenario(build, myProject, "SF Stock Group Membership: Base",
+                  [("stsimsf_StockTypeGroupMembership", subscenario_csv("stsimsf_StockTypeGroupMembership"))],
+                  folderMoves, subscenario_folder_id)
 
 # SF Flow Group Membership -----------------------------
 # SF Flow Group Membership Merged Model
-scenarioName = "SF Flow Group Membership: Base"
-myScenario = myProject.scenarios(scenarioName)
-datasheetName = "stsimsf_FlowTypeGroupMembership"
-myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                              datasheetName, datasheetName + ".csv"))
-myScenario.save_datasheet(datasheetName, myDatasheet)
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, subscenario_folder_id)
+build_subscenario(build, myProject, "SF Flow Group Membership: Base",
+                  [("stsimsf_FlowTypeGroupMembership", subscenario_csv("stsimsf_FlowTypeGroupMembership"))],
+                  folderMoves, subscenario_folder_id)
 
 # CBM Crosswalk - Stocks -----------------------------
-scenarioName = "CBM Crosswalk - Stocks"
-myScenario = myProject.scenarios(scenarioName)
-
-datasheetName = "stsimcbmcfs3_CrosswalkStock"
-myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                          datasheetName, datasheetName + ".csv")) 
-myScenario.save_datasheet(datasheetName, myDatasheet)
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, subscenario_folder_id)
+build_subscenario(build, myProject, "CBM Crosswalk - Stocks",
+                  [("stsimcbmcfs3_CrosswalkStock", subscenario_csv("stsimcbmcfs3_CrosswalkStock"))],
+                  folderMoves, subscenario_folder_id)
 
 # CBM Crosswalk - Spatial Unit and Species Type -----------------------------
 # Fire - Forest
-scenarioName = "CBM Crosswalk - Spatial Unit and Species Type - Fire - Forest"
-myScenario = myProject.scenarios(scenarioName)
-
-datasheetName = "stsimcbmcfs3_CrosswalkSpecies"
-myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                          datasheetName, datasheetName + FOREST_SUFFIX + "_Fire.csv")) 
-myScenario.save_datasheet(datasheetName, myDatasheet)
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, subscenario_folder_id)
+build_subscenario(build, myProject, "CBM Crosswalk - Spatial Unit and Species Type - Fire - Forest",
+                  [("stsimcbmcfs3_CrosswalkSpecies",
+                    subscenario_csv("stsimcbmcfs3_CrosswalkSpecies", FOREST_SUFFIX + "_Fire"))],
+                  folderMoves, subscenario_folder_id)
 
 # Fire - Harvest
-scenarioName = "CBM Crosswalk - Spatial Unit and Species Type - Harvest - Forest"
-myScenario = myProject.scenarios(scenarioName)
-
-datasheetName = "stsimcbmcfs3_CrosswalkSpecies"
-myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                          datasheetName, datasheetName + FOREST_SUFFIX + "_Harvest.csv")) 
-myScenario.save_datasheet(datasheetName, myDatasheet)
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, subscenario_folder_id)
+build_subscenario(build, myProject, "CBM Crosswalk - Spatial Unit and Species Type - Harvest - Forest",
+                  [("stsimcbmcfs3_CrosswalkSpecies",
+                    subscenario_csv("stsimcbmcfs3_CrosswalkSpecies", FOREST_SUFFIX + "_Harvest"))],
+                  folderMoves, subscenario_folder_id)
 
 # CBM Crosswalk - Disturbance -----------------------------
-scenarioName = "CBM Crosswalk - Disturbance"
-myScenario = myProject.scenarios(scenarioName)
-
-datasheetName = "stsimcbmcfs3_CrosswalkDisturbance"
-myDatasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR,
-                          datasheetName, datasheetName + ".csv")) 
-myScenario.save_datasheet(datasheetName, myDatasheet)
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, subscenario_folder_id)
\ No newline at end of file
+build_subscenario(build, myProject, "CBM Crosswalk - Disturbance",
+                  [("stsimcbmcfs3_CrosswalkDisturbance", subscenario_csv("stsimcbmcfs3_CrosswalkDisturbance"))],
+                  folderMoves, subscenario_folder_id)
+
+# Move subscenarios into their folder
+build.built_moves(folderMoves.flush())
+
+# Record the library as built and report what was rebuilt
+build.save()
+build.report()
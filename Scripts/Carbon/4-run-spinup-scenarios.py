@@ -48,60 +48,42 @@ cbmcfs3_folder_id = create_project_folder(mySession,
                                           folder_name="CBM-CFS3 Scenarios")
 
 #### CBM-CFS3 Scenarios #### -----------------------------
-# Load CBM Output ------
-# Fire - Forest
-scenarioName = "Load CBM Output - Fire - Forest"
-myScenario = myProject.scenarios(scenarioName)
-myScenario.dependencies(dependency = ["CBM Crosswalk - Stocks",
-                                      "CBM Crosswalk - Spatial Unit and Species Type - Fire - Forest",
-                                      "Run Control: Non-spatial, 300 yr, 1 MC",
-                                      "Pipeline - Load CBM-CFS3 Output"])
-
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, cbmcfs3_folder_id)
-
-myScenario.run(jobs=1)
-
-# Harvest - Forest
-scenarioName = "Load CBM Output - Harvest - Forest"
-myScenario = myProject.scenarios(scenarioName)
-myScenario.dependencies(dependency = ["CBM Crosswalk - Stocks",
-                                      "CBM Crosswalk - Spatial Unit and Species Type - Harvest - Forest",
-                                      "Run Control: Non-spatial, 300 yr, 1 MC",
-                                      "Pipeline - Load CBM-CFS3 Output"])
-
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, cbmcfs3_folder_id)
-
-myScenario.run(jobs=1)
-
-# Generate Flow Multipliers ------
-# Fire - Forest
-scenarioName = "Generate Flow Multipliers - Fire - Forest"
-myScenario = myProject.scenarios(scenarioName)
-myScenario.dependencies(dependency = ["SF Flow Group Membership: Base",
-                                      "SF Stock Group Membership: Base",
-                                      "SF Output Options: Base - Summary Stock & Flow",
-                                      "SF Initial Stocks: Base",
-                                      "SF Flow Pathways: Forest",
-                                      "CBM Crosswalk - Disturbance",
-                                      "Load CBM Output - Fire - Forest",
-                                      "Pipeline - Generate Flow Multipliers"])
-
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, cbmcfs3_folder_id)
-
-myResultScenario = myScenario.run(jobs=1)
-
-# Harvest - Forest
-scenarioName = "Generate Flow Multipliers - Harvest - Forest"
-myScenario = myProject.scenarios(scenarioName)
-myScenario.dependencies(dependency = ["SF Flow Group Membership: Base",
-                                      "SF Stock Group Membership: Base",
-                                      "SF Output Options: Base - Summary Stock & Flow",
-                                      "SF Initial Stocks: Base",
-                                      "SF Flow Pathways: Forest",
-                                      "CBM Crosswalk - Disturbance",
-                                      "Load CBM Output - Harvest - Forest",
-                                      "Pipeline - Generate Flow Multipliers"])
-
-add_scenario_to_folder(mySession, myLibrary, myProject, myScenario, cbmcfs3_folder_id)
-
-myResultScenario = myScenario.run(jobs=1)
+# Dependencies of each scenario to run, in the order the scenarios are run.
+# Each Generate Flow Multipliers scenario depends on the Load CBM Output
+# result of the same disturbance.
+spinup_scenarios = {
+    # Load CBM Output ------
+    "Load CBM Output - Fire - Forest": ["CBM Crosswalk - Stocks",
+                                        "CBM Crosswalk - Spatial Unit and Species Type - Fire - Forest",
+                                        "Run Control: Non-spatial, 300 yr, 1 MC",
+                                        "Pipeline - Load CBM-CFS3 Output"],
+    "Load CBM Output - Harvest - Forest": ["CBM Crosswalk - Stocks",
+                                           "CBM Crosswalk - Spatial Unit and Species Type - Harvest - Forest",
+                                           "Run Control: Non-spatial, 300 yr, 1 MC",
+                                           "Pipeline - Load CBM-CFS3 Output"],
+    # Generate Flow Multipliers ------
+    "Generate Flow Multipliers - Fire - Forest": ["SF Flow Group Membership: Base",
+                                                  "SF Stock Group Membership: Base",
+                                                  "SF Output Options: Base - Summary Stock & Flow",
+                                                  "SF Initial Stocks: Base",
+                                                  "SF Flow Pathways: Forest",
+                                                  "CBM Crosswalk - Disturbance",
+                                                  "Load CBM Output - Fire - Forest",
+                                                  "Pipeline - Generate Flow Multipliers"],
+    "Generate Flow Multipliers - Harvest - Forest": ["SF Flow Group Membership: Base",
+                                                     "SF Stock Group Membership: Base",
+                                                     "SF Output Options: Base - Summary Stock & Flow",
+                                                     "SF Initial Stocks: Base",
+                                                     "SF Flow Pathways: Forest",
+                                                     "CBM Crosswalk - Disturbance",
+                                                     "Load CBM Output - Harvest - Forest",
+                                                     "Pipeline - Generate Flow Multipliers"]}
+
+with FolderMoveQueue(mySession, myLibrary, myProject) as folderMoves:
+    for scenarioName, dependencies in spinup_scenarios.items():
+        myScenario = myProject.scenarios(scenarioName)
+        myScenario.dependencies(dependency = dependencies)
+        folderMoves.add(myScenario, cbmcfs3_folder_id)
+
+for scenarioName in spinup_scenarios:
+    myProject.scenarios(scenarioName).run(jobs=1)
@@ -44,7 +44,7 @@ TransitionGroupsToInclude = [s + " [Type]" for s in TransitionTypesToInclude] +
 ds_names = [SAV_datasheet_name, FM_datasheet_name, FP_datasheet_name]
 
 # Load crosswalk from cbm data to nestweb data
-cbm_to_nestweb_crosswalk = pd.read_csv(os.path.join(CUSTOM_CARBON_DATA_DIR, "nestweb_to_cbm_forest_groups.csv"))
+forest_groups = load_forest_group_crosswalk()
 
 mySession = ps.Session()
 mySession.add_packages("stsim")
@@ -71,68 +71,14 @@ for origin in ["_fire", "_harvest"]:
     else:
         data = retrieve_generate_multipliers_outputs(myProject, result_scenario_ids_harvest)
 
-    data[0] = data[0][data[0]["StateClassID"].isin(cbm_to_nestweb_crosswalk["CBM Forest State Class"].unique())]
-    data[0]["StateClassID"] = data[0]["StateClassID"].replace(cbm_to_nestweb_crosswalk[0:4].set_index(
-        "CBM Forest State Class")["Nestweb Forest State Class"].to_dict())
-    data[0]["StratumID"] = np.NaN
-
-    # Should be using a different crosswalk for forest unknown mapping - hardcode for now
-    # State attribute value
-    forest_unknown_data = pd.DataFrame()
-    for primary_stratum in cbm_to_nestweb_crosswalk["BEC Variant"].dropna().unique():
-        data_new = data[0].copy()
-        state_class = cbm_to_nestweb_crosswalk[cbm_to_nestweb_crosswalk["BEC Variant"] == primary_stratum]["CBM Forest State Class"].item()
-        state_class_nw = cbm_to_nestweb_crosswalk[0:4][cbm_to_nestweb_crosswalk[0:4][
-            "CBM Forest State Class"] == state_class]["Nestweb Forest State Class"].item()
-        data_new = data_new[data_new["StateClassID"] == state_class_nw]
-        data_new["StateClassID"] = STATE_CLASS_FOREST_UNKNOWN
-        data_new["StratumID"] = primary_stratum
-        forest_unknown_data = pd.concat([forest_unknown_data, data_new])
-
-    data[0] = pd.concat([data[0], forest_unknown_data])
-
-    # Only keep values in data that are contained in the crosswalk
-    data[1] = data[1][data[1]["StateClassID"].isin(cbm_to_nestweb_crosswalk["CBM Forest State Class"].unique())]
-    data[1]["StateClassID"] = data[1]["StateClassID"].replace(cbm_to_nestweb_crosswalk[0:4].set_index(
-        "CBM Forest State Class")["Nestweb Forest State Class"].to_dict())
-    data[1]["StratumID"] = np.NaN
-
     # Should be using a different crosswalk for forest unknown mapping - hardcode for now
-    # Flow multiplier
-    forest_unknown_data = pd.DataFrame()
-    for primary_stratum in cbm_to_nestweb_crosswalk["BEC Variant"].dropna().unique():
-        data_new = data[1].copy()
-        state_class = cbm_to_nestweb_crosswalk[cbm_to_nestweb_crosswalk["BEC Variant"] == primary_stratum]["CBM Forest State Class"].item()
-        state_class_nw = cbm_to_nestweb_crosswalk[0:4][cbm_to_nestweb_crosswalk[0:4][
-            "CBM Forest State Class"] == state_class]["Nestweb Forest State Class"].item()
-        data_new = data_new[data_new["StateClassID"] == state_class_nw]
-        data_new["StateClassID"] = STATE_CLASS_FOREST_UNKNOWN
-        data_new["StratumID"] = primary_stratum
-        forest_unknown_data = pd.concat([forest_unknown_data, data_new])
-
-    data[1] = pd.concat([data[1], forest_unknown_data])
+    # State attribute value and flow multiplier
+    data[0] = expand_forest_unknown(data[0], forest_groups)
+    data[1] = expand_forest_unknown(data[1], forest_groups)
 
-    lulc_data = data[2][data[2].FromStateClassID.isnull()]
-    data[2].FromStateClassID.unique()
-    data[2] = data[2][data[2]["FromStateClassID"].isin(cbm_to_nestweb_crosswalk["CBM Forest State Class"].unique())]
-    data[2]["FromStateClassID"] = data[2]["FromStateClassID"].replace(cbm_to_nestweb_crosswalk[0:4].set_index(
-        "CBM Forest State Class")["Nestweb Forest State Class"].to_dict())
-    data[2]["FromStratumID"] = np.NaN
-
-    # Should be using a different crosswalk for forest unknown mapping - hardcode for now
     # Flow pathway
-    forest_unknown_data = pd.DataFrame()
-    for primary_stratum in cbm_to_nestweb_crosswalk["BEC Variant"].dropna().unique():
-        data_new = data[2].copy()
-        state_class = cbm_to_nestweb_crosswalk[cbm_to_nestweb_crosswalk["BEC Variant"] == primary_stratum]["CBM Forest State Class"].item()
-        state_class_nw = cbm_to_nestweb_crosswalk[0:4][cbm_to_nestweb_crosswalk[0:4][
-            "CBM Forest State Class"] == state_class]["Nestweb Forest State Class"].item()
-        data_new = data_new[data_new["FromStateClassID"] == state_class_nw]
-        data_new["FromStateClassID"] = STATE_CLASS_FOREST_UNKNOWN
-        data_new["FromStratumID"] = primary_stratum
-        forest_unknown_data = pd.concat([forest_unknown_data, data_new])
-
-    data[2] = pd.concat([lulc_data, data[2], forest_unknown_data])
+    lulc_data = data[2][data[2].FromStateClassID.isnull()]
+    data[2] = pd.concat([lulc_data, expand_forest_unknown(data[2], forest_groups)])
 
     # Need to also add net growth to flow pathways
     np.unique(data[2]["TransitionGroupID"].astype(str))
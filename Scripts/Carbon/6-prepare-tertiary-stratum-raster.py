@@ -46,13 +46,13 @@ my_library = ps.library(name = os.path.join(LIBRARY_DIR, "Working", LIBRARY_CARB
 my_project = my_library.projects(name = "Definitions")
 
 # Load crosswalk from cbm data to nestweb data
-cbm_to_nestweb_crosswalk = pd.read_csv(os.path.join(CUSTOM_CARBON_DATA_DIR, "nestweb_to_cbm_forest_groups.csv"))
+forest_groups = load_forest_group_crosswalk()
 
 #%%
 # Add tertiary stratum values to project (forest origin)
 tertiary_stratum = pd.DataFrame(
-    {"Name": cbm_to_nestweb_crosswalk[0:4]["Nestweb Forest State Class"],
-     "ID": list(range(1,5))})
+    {"Name": forest_groups.origins,
+     "ID": list(range(1, len(forest_groups.origins) + 1))})
 tertiary_stratum_datasheet = tertiary_stratum.copy()
 tertiary_stratum_datasheet.Name = "Origin " + tertiary_stratum_datasheet.Name
 my_project.save_datasheet("stsim_TertiaryStratum", tertiary_stratum_datasheet, append = False, force = True)
@@ -62,15 +62,6 @@ my_scenario = my_project.scenarios(name = "Initial Conditions - Baseline Ownersh
 my_datasheet = my_scenario.datasheets(name = "stsim_InitialConditionsSpatial", show_full_paths=True)
 
 #%%
-# Load primary stratum and state class rasters
-with rio.open(my_datasheet.StratumFileName[0]) as src:
-    stratum = src.read(1)
-    stratum_meta = src.meta
-
-with rio.open(my_datasheet.StateClassFileName[0]) as src:
-    state_class = src.read(1)
-    state_class_meta = src.meta
-
 # Create tertiary stratum raster
 stratum_datasheet = my_project.datasheets("stsim_Stratum")
 sc_datasheet = my_project.datasheets("stsim_StateClass")
@@ -78,41 +69,34 @@ sc_datasheet = my_project.datasheets("stsim_StateClass")
 # First map by state class
 sc_id_crosswalk = tertiary_stratum.merge(sc_datasheet, on= "Name")
 
-# replace ids in state class raster w/ tertiary stratum ids
-for i in range(len(sc_id_crosswalk)):
-    state_class[state_class == sc_id_crosswalk.ID_y[i]] = sc_id_crosswalk.ID_x[i]
-
 # Then map by stratum
-stratum_to_state_class = {"Name": [], "State Class": []}
-for primary_stratum in cbm_to_nestweb_crosswalk["BEC Variant"].dropna().unique():
-    state_class_cbm = cbm_to_nestweb_crosswalk[cbm_to_nestweb_crosswalk["BEC Variant"] == primary_stratum]["CBM Forest State Class"].item()
-    state_class_nw = cbm_to_nestweb_crosswalk[0:4][cbm_to_nestweb_crosswalk[0:4][
-        "CBM Forest State Class"] == state_class_cbm]["Nestweb Forest State Class"].item()
-    stratum_to_state_class["Name"].append(primary_stratum)
-    stratum_to_state_class["State Class"].append(state_class_nw)
-
-stratum_to_state_class = pd.DataFrame(stratum_to_state_class)
+stratum_to_state_class = forest_groups.variant_origins(stratum_column="Name",
+                                                       state_class_column="State Class")
 stratum_to_state_class = stratum_to_state_class.merge(stratum_datasheet, on="Name")
 stratum_id_crosswalk = tertiary_stratum.merge(stratum_to_state_class, left_on= "Name", right_on="State Class")
 
-for i in range(len(stratum_id_crosswalk)):
-    stratum[stratum == stratum_id_crosswalk.ID_y[i]] = stratum_id_crosswalk.ID_x[i]
-
-# Replace values in state class raster that do not correspond to tertiary ID with values
-# from the stratum raster - want to mask multiple values
-state_class_mask = np.logical_or.reduce([state_class == v for v in [1,2,3,4]])
-stratum_mask = np.logical_or.reduce([state_class == v for v in [40]])
-
-new_array = np.copy(state_class)
-new_array[state_class_mask] = state_class[state_class_mask]
-new_array[stratum_mask] = stratum[stratum_mask]
-
-new_array[~np.isin(new_array, [1,2,3,4])]= -9999
+# Lookup tables from state class and stratum ids to tertiary stratum ids;
+# values that do not correspond to a tertiary ID become -9999
+state_class_remap = compile_remap_lut(dict(zip(sc_id_crosswalk.ID_y, sc_id_crosswalk.ID_x)),
+                                      valid=tertiary_stratum.ID)
+stratum_remap = compile_remap_lut(dict(zip(stratum_id_crosswalk.ID_y, stratum_id_crosswalk.ID_x)),
+                                  valid=tertiary_stratum.ID)
+forest_unknown_id = 40
+
+def tertiary_stratum_block(state_class, stratum):
+    # Use the state class origin, or the stratum origin where the state class is forest unknown
+    new_array = state_class_remap.apply(state_class)
+    forest_unknown = state_class == forest_unknown_id
+    new_array[forest_unknown] = stratum_remap.apply(stratum[forest_unknown])
+    return new_array.astype(rio.uint16)
+
+# Write tertiary stratum raster one block at a time
+with rio.open(my_datasheet.StratumFileName[0]) as src:
+    tertiary_stratum_meta = src.meta.copy()
 
-# Write tertiary stratum raster
-tertiary_stratum_meta = stratum_meta.copy()
-with rio.open(os.path.join(MODEL_INPUTS_DIR, "Spatial", "tertiary-stratum.tif"), "w", **tertiary_stratum_meta) as dst:
-    dst.write(new_array.astype(rio.uint16), 1)
+remap_rasters_by_block([my_datasheet.StateClassFileName[0], my_datasheet.StratumFileName[0]],
+                       os.path.join(MODEL_INPUTS_DIR, "Spatial", "tertiary-stratum.tif"),
+                       tertiary_stratum_block, tertiary_stratum_meta)
 
 # Add tertiary stratum raster to project
 my_datasheet.TertiaryStratumFileName = os.path.join(MODEL_INPUTS_DIR, "Spatial", "tertiary-stratum.tif")
@@ -43,13 +43,17 @@ my_library = ps.library(name = os.path.join(LIBRARY_DIR, LIBRARY_CARBON_LULC_FIL
 
 my_project = my_library.projects(name = "Definitions")
 
-folder_df = list_folders_in_library(my_session, my_library)
+folders = folder_registry(my_session, my_library)
+
+# Moves into folders are queued and run together at the end
+folder_moves = FolderMoveQueue(my_session, my_library, my_project)
 
 # Load crosswalk from cbm data to nestweb data
-cbm_to_nestweb_crosswalk = pd.read_csv(os.path.join(CUSTOM_CARBON_DATA_DIR, "nestweb_to_cbm_forest_groups.csv"))
+forest_groups = load_forest_group_crosswalk()
 
 # Local vars
 no_data = -9999
+writeStocksByBlock = False # Set to True to compute initial stock rasters block by block for large study areas
 
 #%%
 # Create folder for storing rasters
@@ -131,8 +135,8 @@ my_datasheet = my_datasheet[~my_datasheet.StockGroupID.str.contains("tons C/ha")
 my_scenario.save_datasheet(name = datasheet_name, data = my_datasheet)
 
 # Add scenario to stock flow folder
-fid = str(folder_df[folder_df.Name.str.contains("Stocks & Flows")].iloc[0].ID)
-add_scenario_to_folder(my_session, my_library, my_project, my_scenario, fid)
+fid = folders.find("Stocks & Flows")
+folder_moves.add(my_scenario, fid)
 base_dependencies.append(scenario_name)
 
 # Add Flow Group Membership
@@ -143,8 +147,8 @@ my_datasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_DATASHEET_DIR, datasheet_n
 my_scenario.save_datasheet(name = datasheet_name, data = my_datasheet)
 
 # Add scenario to stock flow folder
-fid = str(folder_df[folder_df.Name.str.contains("Stocks & Flows")].iloc[0].ID)
-add_scenario_to_folder(my_session, my_library, my_project, my_scenario, fid)
+fid = folders.find("Stocks & Flows")
+folder_moves.add(my_scenario, fid)
 base_dependencies.append(scenario_name)
 
 # Add Flow Order
@@ -159,8 +163,8 @@ my_datasheet = pd.read_csv(os.path.join(CUSTOM_CARBON_DATASHEET_DIR, datasheet_n
 my_scenario.save_datasheet(name = datasheet_name, data = my_datasheet)
 
 # Add scenario to stock flow folder
-fid = str(folder_df[folder_df.Name.str.contains("Stocks & Flows")].iloc[0].ID)
-add_scenario_to_folder(my_session, my_library, my_project, my_scenario, fid)
+fid = folders.find("Stocks & Flows")
+folder_moves.add(my_scenario, fid)
 base_dependencies.append(scenario_name)
 #%%
 ### Spatial ---
@@ -173,23 +177,9 @@ ic_spatial_scn = my_project.scenarios(name = scn_name)
 ic_spatial = ic_spatial_scn.datasheets("stsim_InitialConditionsSpatial", show_full_paths=True)
 
 #%%
-forest_age_raster = rioxarray.open_rasterio(ic_spatial.AgeFileName.iloc[0])
-forest_type_raster = rioxarray.open_rasterio(ic_spatial.TertiaryStratumFileName.iloc[0])
-state_class_raster = rioxarray.open_rasterio(ic_spatial.StateClassFileName.iloc[0])
-
 # Grab raster metadata
 with rio.open(ic_spatial.StratumFileName.iloc[0]) as src:
-    crs = src.crs
     meta = src.profile
-    
-
-meta.update(dtype=rio.float32)
-raster_dims = forest_age_raster.shape
-raster_length = forest_age_raster.size
-
-cell_info = pd.DataFrame({"age": forest_age_raster.values.reshape(raster_length, -1).squeeze(),
-                          "forest_type_group": forest_type_raster.values.reshape(raster_length, -1).squeeze(),
-                          "state_class": state_class_raster.values.reshape(raster_length, -1).squeeze()})
 
 # Load state attribute values as lookup table
 sav_lookup_fire = pd.read_csv(os.path.join(CUSTOM_MERGED_SUBSCENARIOS_DIR, 
@@ -198,12 +188,8 @@ sav_lookup_fire = pd.read_csv(os.path.join(CUSTOM_MERGED_SUBSCENARIOS_DIR,
 sav_lookup_fire["origin"] = "fire"
 sav_lookup_fire.TertiaryStratumID = "Origin " + sav_lookup_fire.StateClassID
 
-for primary_stratum in cbm_to_nestweb_crosswalk["BEC Variant"].dropna().unique():
-    state_class = cbm_to_nestweb_crosswalk[cbm_to_nestweb_crosswalk["BEC Variant"] == primary_stratum]["CBM Forest State Class"].item()
-    state_class_nw = cbm_to_nestweb_crosswalk[0:4][cbm_to_nestweb_crosswalk[0:4][
-        "CBM Forest State Class"] == state_class]["Nestweb Forest State Class"].item()
-    
-    sav_lookup_fire.loc[sav_lookup_fire["StratumID"] == primary_stratum, "TertiaryStratumID"] = "Origin " + state_class_nw
+is_variant = sav_lookup_fire["StratumID"].isin(forest_groups.variants)
+sav_lookup_fire.loc[is_variant, "TertiaryStratumID"] = "Origin " + forest_groups.origin_of(sav_lookup_fire.loc[is_variant, "StratumID"])
 
 sav_lookup_harvest = pd.read_csv(os.path.join(CUSTOM_MERGED_SUBSCENARIOS_DIR,
                                               "stsim_StateAttributeValue",
@@ -211,12 +197,8 @@ sav_lookup_harvest = pd.read_csv(os.path.join(CUSTOM_MERGED_SUBSCENARIOS_DIR,
 sav_lookup_harvest["origin"] = "harvest"
 sav_lookup_harvest.TertiaryStratumID = "Origin " + sav_lookup_harvest.StateClassID
 
-for primary_stratum in cbm_to_nestweb_crosswalk["BEC Variant"].dropna().unique():
-    state_class = cbm_to_nestweb_crosswalk[cbm_to_nestweb_crosswalk["BEC Variant"] == primary_stratum]["CBM Forest State Class"].item()
-    state_class_nw = cbm_to_nestweb_crosswalk[0:4][cbm_to_nestweb_crosswalk[0:4][
-        "CBM Forest State Class"] == state_class]["Nestweb Forest State Class"].item()
-    
-    sav_lookup_harvest.loc[sav_lookup_harvest["StratumID"] == primary_stratum, "TertiaryStratumID"] = "Origin " + state_class_nw
+is_variant = sav_lookup_harvest["StratumID"].isin(forest_groups.variants)
+sav_lookup_harvest.loc[is_variant, "TertiaryStratumID"] = "Origin " + forest_groups.origin_of(sav_lookup_harvest.loc[is_variant, "StratumID"])
 
 sav_lookup = pd.concat([sav_lookup_fire, sav_lookup_harvest])
 
@@ -232,105 +214,64 @@ sav_lookup = sav_lookup.merge(state_class_datasheet[["Name", "ID"]],
                               left_on="StateClassID", right_on="Name")
 sav_lookup.rename(columns = {"ID": "state_class"}, inplace=True)
 
-# Turn time since most recent disturbance rasters into binary arrays
-tst_fire_path = os.path.join(MODEL_INPUTS_DIR, "Spatial", "time-since-fire.tif")
-tst_harvest_path = os.path.join(MODEL_INPUTS_DIR, "Spatial", "time-since-cut.tif")
-
-with rio.open(tst_fire_path) as src:
-    tst_fire = src.read(1)
-with rio.open(tst_harvest_path) as src:
-    tst_harvest = src.read(1)
-
-tst_fire = tst_fire.astype(float)
-tst_fire[tst_fire == -9999] = np.NaN
-tst_harvest = tst_harvest.astype(float)
-tst_harvest[tst_harvest == -9999] = np.NaN
-cell_info["tst_fire"] = tst_fire.reshape(raster_length, -1).squeeze()
-cell_info["tst_harvest"] = tst_harvest.reshape(raster_length, -1).squeeze()
-
-# compare harvest and fire columns, set higher value to Nan
-cell_info["tst_harvest"] = np.where(cell_info["tst_harvest"] > cell_info["tst_fire"], np.NaN, cell_info["tst_harvest"])
-cell_info["tst_fire"] = np.where(cell_info["tst_fire"] > cell_info["tst_harvest"], np.NaN, cell_info["tst_fire"])
-cell_info["tst_fire"] = np.where(cell_info["tst_fire"] == cell_info["tst_harvest"], np.NaN, cell_info["tst_fire"])
-
-# Set all non NaN values to 1
-cell_info["tst_fire"] = np.where(cell_info["tst_fire"].notnull(), 1, cell_info["tst_fire"])
-cell_info["tst_harvest"] = np.where(cell_info["tst_harvest"].notnull(), 1, cell_info["tst_harvest"])
-
-# Set all NaN values to 0
-cell_info["tst_fire"] = np.where(cell_info["tst_fire"].isnull(), 0, cell_info["tst_fire"])
-cell_info["tst_harvest"] = np.where(cell_info["tst_harvest"].isnull(), 0, cell_info["tst_harvest"])
-
 # Retrieve datasheet with initial stocks
 stock_non_spatial_scenario_name = "Initial Stocks Non Spatial"
 stock_non_spatial_scenario = my_project.scenarios(stock_non_spatial_scenario_name)
 initial_stocks = stock_non_spatial_scenario.datasheets("stsimsf_InitialStockNonSpatial")
-initial_stocks_spatial = pd.DataFrame({"StockTypeID": [], "RasterFileName": []})
+initial_stocks = initial_stocks[initial_stocks.StateAttributeTypeID.str.startswith("Carbon")]
 
-# Loop through all available state attribute ids to create all input rasters
-for row in initial_stocks.itertuples():
+# Compile state attribute values into a lookup array
+sav_lut = build_initial_stock_lut(sav_lookup, initial_stocks.StateAttributeTypeID.unique(), no_data=no_data)
+forest_state_classes = [40, 41, 42, 43, 44]
 
-    sa_id = row.StateAttributeTypeID
-
-    if not sa_id.startswith("Carbon"):
-        continue
-
-    stock_id = row.StockTypeID
-    stock_id_clean = stock_id.split(":")[1].strip(" ")
-
-    initial_stock_data = cell_info.copy()
-
-    # Create initial stock fire and harvest rasters
-    for origin in ["fire", "harvest"]:
-
-        sav_lookup_temp = sav_lookup[sav_lookup.StateAttributeTypeID == sa_id]
-        sav_lookup_temp = sav_lookup_temp[sav_lookup_temp.origin == origin]
-        sav_lookup_temp = sav_lookup_temp[["age", "forest_type_group", "state_class", "Value"]]
-        sav_lookup_temp = sav_lookup_temp.drop_duplicates()
-
-        sav_lookup_temp.fillna(-9999, inplace=True)
-        no_data_row = pd.DataFrame({"age": [-9999],
-                                    "forest_type_group": [-9999],
-                                    "state_class": [-9999],
-                                    "Value": [-9999]})
-        sav_lookup_temp = pd.concat([sav_lookup_temp, no_data_row])
-
-        # Merge state attribute value information with cell info and write to raster
-        initial_stock_data = initial_stock_data.merge(sav_lookup_temp, on=["age", "forest_type_group", "state_class"], how="left")
-        initial_stock_data.rename(columns = {"Value": origin}, inplace=True)
-        initial_stock_data[origin] = initial_stock_data[origin] * initial_stock_data[f"tst_{origin}"]
-
-    # Where there is no recent disturbance, fill SAV with fire values
-    sav_lookup_temp = sav_lookup[sav_lookup.StateAttributeTypeID == sa_id]
-    sav_lookup_temp = sav_lookup_temp[sav_lookup_temp.origin == 'fire']
-    sav_lookup_temp = sav_lookup_temp[["age", "forest_type_group", "state_class", "Value"]]
-    sav_lookup_temp = sav_lookup_temp.drop_duplicates()
-
-    sav_lookup_temp.fillna(-9999, inplace=True)
-    no_data_row = pd.DataFrame({"age": [-9999],
-                                "forest_type_group": [-9999],
-                                "state_class": [-9999],
-                                "Value": [-9999]})
-    sav_lookup_temp = pd.concat([sav_lookup_temp, no_data_row])
-    
-    # Merge state attribute value information with cell info and write to raster
-    initial_stock_data = initial_stock_data.merge(sav_lookup_temp, on=["age", "forest_type_group", "state_class"], how="left")
-    initial_stock_data.rename(columns = {"Value": "no_disturbance"}, inplace=True)   
-    initial_stock_data["Value"] = initial_stock_data["fire"] + initial_stock_data["harvest"]
-    initial_stock_data["Value"] = np.where(initial_stock_data["Value"] == 0, initial_stock_data["no_disturbance"], initial_stock_data["Value"])
-    initial_stock_data["Value"] = np.where(initial_stock_data["Value"].isnull(), 0, initial_stock_data["Value"])
-    initial_stock_data["Value"] = np.where(initial_stock_data["state_class"] == -9999, -9999, initial_stock_data["Value"])
-    initial_stock_data["Value"] = np.where(initial_stock_data["state_class"].isnull(), -9999, initial_stock_data["Value"])
-    initial_stock_data["Value"] = np.where((initial_stock_data["state_class"].isin([40,41,42,43,44])), initial_stock_data["Value"], -9999)
-    raster_data = np.array(initial_stock_data.Value).reshape(1, raster_dims[1], -1)
+# Create an input raster for each available state attribute id
+stock_rasters = {}
+for row in initial_stocks.itertuples():
+    stock_id_clean = row.StockTypeID.split(":")[1].strip(" ")
     filepath = os.path.join(CUSTOM_MERGED_SUBSCENARIOS_DIR, "stsimsf_InitialStockSpatial", f"{stock_id_clean}.tif")
+    stock_rasters[filepath] = row.StateAttributeTypeID
 
-    with rio.open(filepath, 'w', **meta) as dst:
-        dst.crs = crs
-        dst.write(raster_data)
+initial_stocks_spatial = pd.DataFrame({"StockTypeID": initial_stocks.StockTypeID.tolist(),
+                                       "RasterFileName": list(stock_rasters)})
 
-    # Fill datasheet with initial stocks
-    initial_stocks_spatial = pd.concat([initial_stocks_spatial, pd.DataFrame({"StockTypeID": [stock_id], "RasterFileName": [filepath]})])
+tst_fire_path = os.path.join(MODEL_INPUTS_DIR, "Spatial", "time-since-fire.tif")
+tst_harvest_path = os.path.join(MODEL_INPUTS_DIR, "Spatial", "time-since-cut.tif")
+
+if writeStocksByBlock:
+    write_initial_stock_rasters_by_block(sav_lut, stock_rasters,
+                                         {"state_class": ic_spatial.StateClassFileName.iloc[0],
+                                          "forest_type_group": ic_spatial.TertiaryStratumFileName.iloc[0],
+                                          "age": ic_spatial.AgeFileName.iloc[0],
+                                          "tst_fire": tst_fire_path,
+                                          "tst_harvest": tst_harvest_path},
+                                         meta, forest_state_classes, no_data)
+else:
+    forest_age_raster = rioxarray.open_rasterio(ic_spatial.AgeFileName.iloc[0])
+    forest_type_raster = rioxarray.open_rasterio(ic_spatial.TertiaryStratumFileName.iloc[0])
+    state_class_raster = rioxarray.open_rasterio(ic_spatial.StateClassFileName.iloc[0])
+    raster_dims = forest_age_raster.shape
+
+    # Flag the most recent disturbance of each cell from the time since disturbance rasters
+    with rio.open(tst_fire_path) as src:
+        tst_fire = src.read(1)
+    with rio.open(tst_harvest_path) as src:
+        tst_harvest = src.read(1)
+
+    fire_flag, harvest_flag = disturbance_origin_flags(tst_fire, tst_harvest, no_data)
+
+    # Find the position of each cell in the lookup array
+    state_class = state_class_raster.values.squeeze()
+    cell_index, cell_found = sav_lut.cell_index(state_class,
+                                                forest_type_raster.values.squeeze(),
+                                                forest_age_raster.values.squeeze())
+
+    # Use the values of the most recent disturbance, or fire values where there is no recent disturbance
+    def compute_values(sa_id):
+        values = initial_stock_values(sav_lut, sa_id, cell_index, cell_found, fire_flag, harvest_flag,
+                                      state_class, forest_state_classes, no_data)
+        return values.reshape(raster_dims[1], -1)
+
+    write_stock_rasters(stock_rasters, compute_values, meta)
 
 #%%
 # Save datasheet with initial stocks
@@ -379,7 +320,7 @@ my_datasheet.replace(CBM_FOREST_CLEARCUT_TRANSITION + " [Type]", FOREST_CLEARCUT
 my_datasheet.drop_duplicates(inplace = True)
 
 forest_values = pd.DataFrame(data=None, columns=my_datasheet.columns)
-forest_types = pd.unique(cbm_to_nestweb_crosswalk['Nestweb Forest State Class']).tolist()
+forest_types = forest_groups.origins + [STATE_CLASS_FOREST_UNKNOWN]
 for forest_type in forest_types:
     updated_rows = my_datasheet[my_datasheet['FlowTypeID'].str.contains("Net Growth Forest")]
     updated_rows['FromStateClassID'] = forest_type
@@ -404,15 +345,11 @@ new_fire_values = pd.read_csv(os.path.join(CUSTOM_MERGED_SUBSCENARIOS_DIR, datas
 tertiary_stratum = my_project.datasheets("stsim_TertiaryStratum")
 new_fire_values.TertiaryStratumID = "Origin " + new_fire_values.StateClassID
 
-for primary_stratum in cbm_to_nestweb_crosswalk["BEC Variant"].dropna().unique():
-    state_class = cbm_to_nestweb_crosswalk[cbm_to_nestweb_crosswalk["BEC Variant"] == primary_stratum]["CBM Forest State Class"].item()
-    state_class_nw = cbm_to_nestweb_crosswalk[0:4][cbm_to_nestweb_crosswalk[0:4][
-        "CBM Forest State Class"] == state_class]["Nestweb Forest State Class"].item()
-    
-    new_fire_values.loc[new_fire_values["StratumID"] == primary_stratum, "TertiaryStratumID"] = "Origin " + state_class_nw
+is_variant = new_fire_values["StratumID"].isin(forest_groups.variants)
+new_fire_values.loc[is_variant, "TertiaryStratumID"] = "Origin " + forest_groups.origin_of(new_fire_values.loc[is_variant, "StratumID"])
 
 # Add cropland/developed flow multipliers for when transitioning from forest
-forest_origins = cbm_to_nestweb_crosswalk[0:4]["Nestweb Forest State Class"].unique()
+forest_origins = forest_groups.origins
 cropland_values = new_fire_values[new_fire_values.StateClassID.isin(forest_origins)]
 cropland_values["StateClassID"] = STATE_CLASS_AGRICULTURE
 developed_values = new_fire_values[new_fire_values.StateClassID.isin(forest_origins)]
@@ -438,12 +375,8 @@ my_datasheet = pd.read_csv(os.path.join(CUSTOM_MERGED_SUBSCENARIOS_DIR, datashee
                                         datasheet_name + "_fire_cbm_output.csv"))
 my_datasheet.TertiaryStratumID = "Origin " + my_datasheet.StateClassID
 
-for primary_stratum in cbm_to_nestweb_crosswalk["BEC Variant"].dropna().unique():
-    state_class = cbm_to_nestweb_crosswalk[cbm_to_nestweb_crosswalk["BEC Variant"] == primary_stratum]["CBM Forest State Class"].item()
-    state_class_nw = cbm_to_nestweb_crosswalk[0:4][cbm_to_nestweb_crosswalk[0:4][
-        "CBM Forest State Class"] == state_class]["Nestweb Forest State Class"].item()
-    
-    my_datasheet.loc[my_datasheet["StratumID"] == primary_stratum, "TertiaryStratumID"] = "Origin " + state_class_nw
+is_variant = my_datasheet["StratumID"].isin(forest_groups.variants)
+my_datasheet.loc[is_variant, "TertiaryStratumID"] = "Origin " + forest_groups.origin_of(my_datasheet.loc[is_variant, "StratumID"])
 
 grass_values = pd.read_csv(os.path.join(CUSTOM_CARBON_DATASHEET_DIR, datasheet_name + "_ShrubGrass.csv"))
 grass_values = grass_values[grass_values["StateClassID"] == STATE_CLASS_GRASS]
@@ -453,8 +386,8 @@ my_datasheet["AgeMax"] = my_datasheet.AgeMax.astype("Int64")
 my_scenario.save_datasheet(name = datasheet_name, data = my_datasheet)
 
 # Add scenario to state attribute values folder
-fid = str(folder_df[folder_df.Name.str.contains("State Attribute Values")].iloc[0].ID)
-add_scenario_to_folder(my_session, my_library, my_project, my_scenario, fid)
+fid = folders.find("State Attribute Values")
+folder_moves.add(my_scenario, fid)
 base_dependencies.append(scenario_name)
 # %%
 # Add all new datasheets as dependencies to existing scenarios
@@ -467,3 +400,7 @@ for scn in SPATIAL_SCENARIO_NAMES:
     my_scenario = my_project.scenarios(name = scn)
     my_scenario.dependencies(base_dependencies)
 # %%
+
+# Move new scenarios into their folders
+folder_moves.flush()
+# %%
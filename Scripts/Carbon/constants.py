@@ -13,6 +13,15 @@ import os
 CBM_DBASE = "C:/Program Files (x86)/Operational-Scale CBM-CFS3/Admin/DBs/ArchiveIndex_Beta_Install.mdb"
 CUSTOM_FOLDER_NAME = "Carbon"
 
+# Datasheet csv exports - writer is "columnar" or "pandas"; the Parquet
+# sidecar needs pyarrow
+EXPORT_CSV_WRITER = os.environ.get("NESTWEB_EXPORT_CSV_WRITER", "columnar")
+EXPORT_PARQUET_SIDECAR = os.environ.get("NESTWEB_EXPORT_PARQUET_SIDECAR", "0") == "1"
+EXPORT_MAX_WORKERS = int(os.environ.get("NESTWEB_EXPORT_MAX_WORKERS", 4))
+
+# Initial stock rasters written at once - each holds full-size arrays in memory
+STOCK_RASTER_MAX_WORKERS = int(os.environ.get("NESTWEB_STOCK_RASTER_MAX_WORKERS", 2))
+
 ## Directories ----
 ### Core directories
 cwd = os.getcwd()
@@ -42,6 +51,8 @@ CONUS_CARBON_CBM_OUTPUT_DIR = os.path.join(CUSTOM_CARBON_DATA_DIR, "CBM Output F
 
 # Intermediates
 CUSTOM_INTERMEDIATES_DIR = os.path.join(INTERMEDIATES_DIR, CUSTOM_FOLDER_NAME)
+FOREST_GROUP_CROSSWALK_CACHE_DIR = os.path.join(CUSTOM_INTERMEDIATES_DIR, "Forest Group Crosswalk Cache")
+GDAL_PATH_CACHE_FILE = os.path.join(CUSTOM_INTERMEDIATES_DIR, "gdal_path_cache.json")
 
 # Model Inputs
 CUSTOM_INPUTS_DIR = os.path.join(MODEL_INPUTS_DIR, CUSTOM_FOLDER_NAME)
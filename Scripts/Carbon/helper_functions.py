@@ -6,46 +6,111 @@ import pandas as pd
 import numpy as np
 import os
 import re
+import atexit
 import io
+import json
+import hashlib
+import pathlib
+import shutil
+import sqlite3
 import subprocess
-from dask.distributed import Client, Lock
-import rioxarray as rxr
-import glob
-from win32api import GetFileVersionInfo, LOWORD, HIWORD
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
 from constants import *
 pd.options.mode.chained_assignment = None  # default='warn'
 
-# Load rioxarray
-gdal_installations = []
-if "PATH" in os.environ:
-  for p in os.environ["PATH"].split(os.pathsep):
-    if p and glob.glob(os.path.join(p, "gdal*.dll")):
-      gdal_installations.append(os.path.abspath(p))
-
-if len(gdal_installations) > 1:
-    for folder in gdal_installations:
-        filenames = [f for f in os.listdir(folder) if f.startswith("gdal") & f.endswith(".dll")]
+# Raster modules are imported on first use so scripts that only work with
+# tables start quickly
+class _LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+rio = _LazyModule("rasterio")
+windows = _LazyModule("rasterio.windows")
+
+def _write_json(path, obj):
+    # Write to a temporary file first so that a stage reading the file at
+    # the same time never sees it half written
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(temp_path, path)
+
+# Remove GDAL installations older than 3.6 from the PATH so rasterio loads
+# a compatible one. The result is cached for the PATH and the GDAL DLLs on
+# it, so the DLL versions are only inspected when either changes.
+def find_gdal_dlls():
+    import glob
+
+    dlls = {}
+    for p in os.environ["PATH"].split(os.pathsep):
+      if p:
+        filenames = sorted(glob.glob(os.path.join(p, "gdal*.dll")))
+        if filenames:
+          dlls[os.path.abspath(p)] = filenames
+    return dlls
+
+def find_outdated_gdal_folders(gdal_dlls):
+    outdated = []
+    if len(gdal_dlls) > 1:
+        from win32api import GetFileVersionInfo, LOWORD, HIWORD
+
+        for folder, filenames in gdal_dlls.items():
+            for filename in filenames:
+                try:
+                    info = GetFileVersionInfo (filename, "\\")
+                except:
+                    continue
+
+                major_version = HIWORD (info['FileVersionMS'])
+                minor_version = LOWORD (info['FileVersionMS'])
+
+                if (major_version < 3) | (minor_version < 6):
+                    outdated.append(folder)
+
+    return outdated
+
+def configure_gdal_path(cache_file=GDAL_PATH_CACHE_FILE):
+    if "PATH" not in os.environ:
+        return
+
+    gdal_dlls = find_gdal_dlls()
+    key = hashlib.sha1(os.environ["PATH"].encode("utf-8"))
+    for filename in [f for filenames in gdal_dlls.values() for f in filenames]:
+        stat = os.stat(filename)
+        key.update((filename + str(stat.st_size) + str(stat.st_mtime_ns)).encode("utf-8"))
+    key = key.hexdigest()
+
+    # A cache that cannot be read is rebuilt
+    cache = {}
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    if cache.get("key") == key:
+        outdated = cache["outdated"]
+    else:
+        outdated = find_outdated_gdal_folders(gdal_dlls)
+        cache_dir = os.path.dirname(cache_file)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        _write_json(cache_file, {"key": key, "outdated": outdated})
 
-        for filename in filenames:
-            filename = os.path.join(folder, filename)
-        
-            if not os.path.exists(filename):           
-                print("no gdal dlls found in " + folder)
-                os.environ['PATH'] = os.pathsep.join(
-                        [p for p in os.environ['PATH'].split(os.pathsep) if folder not in p])
-                continue
-            try:
-                info = GetFileVersionInfo (filename, "\\")
-            except:
-                continue
-            
-            major_version = HIWORD (info['FileVersionMS'])
-            minor_version = LOWORD (info['FileVersionMS'])
+    for folder in outdated:
+        os.environ['PATH'] = os.pathsep.join(
+            [p for p in os.environ['PATH'].split(os.pathsep) if folder not in p])
 
-            if (major_version < 3) | (minor_version < 6):
-                os.environ['PATH'] = os.pathsep.join(
-                    [p for p in os.environ['PATH'].split(os.pathsep) if folder not in p])
-                
+configure_gdal_path()
 
 # General functions ------------------------------------------------------------
 
@@ -83,19 +148,356 @@ def sav_unit_converter(data, src_units="t/ha", dest_units="t/km2"):
 
 # Functions for all scripts -----------------------------------------------------
 
+def format_fixed(values, decimals=10):
+    """
+    Format floats as "%.<decimals>f" for a whole column at once. Missing
+    values become empty strings.
+
+    Parameters
+    ----------
+    values : array-like
+        Float values
+    decimals : int
+        Number of decimal places
+
+    Returns
+    -------
+    list of str
+        Formatted values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    text = list(map(("%." + str(decimals) + "f").__mod__, values.tolist()))
+    for i in np.flatnonzero(np.isnan(values)):
+        text[i] = ""
+    return text
+
+def _csv_quote(values):
+    # Quote fields like the csv module does with QUOTE_MINIMAL and the
+    # os.linesep line terminator used by pandas, so "\r" is only quoted
+    # where it is part of the line terminator
+    values = list(values)
+    special = pd.Series(values, dtype=object).str.contains(
+        "[" + re.escape(',"\n' + os.linesep) + "]", regex=True)
+    for i in np.flatnonzero(special.to_numpy(dtype=bool)):
+        values[i] = '"' + values[i].replace('"', '""') + '"'
+    return values
+
+def write_csv(datasheet, filepath, decimals=10):
+    """
+    Write a datasheet to csv with the same bytes as
+    datasheet.to_csv(filepath, index=False, float_format="%.<decimals>f"),
+    formatting one column at a time instead of going through the pandas
+    formatters. Falls back to pandas for column types it does not handle
+    (e.g. mixed object columns or dates).
+
+    Parameters
+    ----------
+    datasheet : pandas.DataFrame
+        Datasheet to write
+    filepath : str
+        Path of the csv file
+    decimals : int
+        Number of decimal places of float values
+    """
+    columns = []
+    for _, column in datasheet.items():
+        missing = column.isna().to_numpy(dtype=bool)
+        if pd.api.types.is_bool_dtype(column) or pd.api.types.is_integer_dtype(column):
+            text = column.astype(str).tolist()
+            for i in np.flatnonzero(missing):
+                text[i] = ""
+        elif pd.api.types.is_float_dtype(column):
+            text = format_fixed(column.to_numpy(dtype=np.float64, na_value=np.nan), decimals)
+        elif pd.api.types.is_string_dtype(column) and \
+                all(isinstance(v, str) for v in column[~missing]):
+            text = column.tolist()
+            for i in np.flatnonzero(missing):
+                text[i] = ""
+            text = _csv_quote(text)
+        else:
+            datasheet.to_csv(filepath, index=False, float_format="%." + str(decimals) + "f")
+            return
+        columns.append(text)
+
+    header = ",".join(_csv_quote([str(c) for c in datasheet.columns]))
+    if len(columns) == 1:
+        # A lone empty field is quoted so the row is not blank
+        columns[0] = [v if v else '""' for v in columns[0]]
+    rows = map(",".join, zip(*columns)) if columns else [""] * len(datasheet)
+    with open(filepath, "w", newline="", encoding="utf-8") as f:
+        f.write(os.linesep.join([header, *rows]) + os.linesep)
+
+CSV_WRITERS = {
+    "columnar": write_csv,
+    "pandas": lambda datasheet, filepath: datasheet.to_csv(filepath, index = False,
+                                                           float_format="%.10f")}
+
+_export_executor = None
+_pending_exports = []
+_exports_lock = threading.Lock()
+
+def _write_export(datasheet, filepath, writer, parquet):
+    CSV_WRITERS[writer](datasheet, filepath)
+    if parquet:
+        parquet_path = os.path.splitext(filepath)[0] + ".parquet"
+        datasheet.to_parquet(parquet_path, index=False)
+        # Stamp the copy with the csv time, see read_datasheet
+        csv_stat = os.stat(filepath)
+        os.utime(parquet_path, ns=(csv_stat.st_atime_ns, csv_stat.st_mtime_ns))
+
 def export_datasheets(datasheetName, datasheet, folder=CUSTOM_DEFINITIONS_DIR,
-                      csv_append = ""):
-    
+                      csv_append = "", writer=EXPORT_CSV_WRITER,
+                      parquet=EXPORT_PARQUET_SIDECAR):
+    """
+    Export a datasheet to csv in the background. Exports run on a shared
+    pool of EXPORT_MAX_WORKERS threads; call wait_for_exports() before
+    reading the files in the same script and at the end of the script, so
+    a failed export raises there and the script exits with an error.
+    Exports still pending when Python exits are waited for, but a failure
+    then is only printed.
+
+    Parameters
+    ----------
+    datasheetName : str
+        Name of datasheet
+    datasheet : pandas.DataFrame
+        Datasheet dataframe
+    folder : str
+        Folder to export csv to
+    csv_append : str
+        String to append to csv name
+    writer : str
+        Csv writer, a key of CSV_WRITERS
+    parquet : bool
+        Also write a typed Parquet copy next to the csv, read first by
+        read_datasheet. Needs pyarrow.
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Future of the export
+    """
+    global _export_executor
+    if writer not in CSV_WRITERS:
+        raise ValueError("Unknown csv writer " + writer + "; use one of "
+                         + ", ".join(CSV_WRITERS))
+    if parquet and importlib.util.find_spec("pyarrow") is None:
+        print("pyarrow is not installed; Parquet copy of " + datasheetName + " not written")
+        parquet = False
+
     if not os.path.exists(folder):
         os.makedirs(folder)
-
     filepath = os.path.join(folder, datasheetName + csv_append + ".csv")
-    datasheet.to_csv(filepath, index = False, float_format="%.10f")
+
+    with _exports_lock:
+        if _export_executor is None:
+            _export_executor = ThreadPoolExecutor(max_workers=EXPORT_MAX_WORKERS)
+            atexit.register(_wait_for_exports_at_exit)
+        # Copy so later changes to the datasheet do not reach the file
+        future = _export_executor.submit(_write_export, datasheet.copy(), filepath,
+                                         writer, parquet)
+        _pending_exports.append(future)
+
+    return future
+
+def wait_for_exports():
+    """
+    Wait for all background datasheet exports to finish, raising the first
+    error if any export failed.
+    """
+    with _exports_lock:
+        pending = list(_pending_exports)
+        _pending_exports.clear()
+    errors = [future.exception() for future in pending]
+    errors = [error for error in errors if error is not None]
+    if errors:
+        raise errors[0]
+
+def _wait_for_exports_at_exit():
+    # Exports left when a script ends without calling wait_for_exports().
+    # An error raised here would not change the exit status, so the
+    # failure is only reported
+    try:
+        wait_for_exports()
+    except Exception:
+        print("A datasheet export failed after the script ended:")
+        traceback.print_exc()
+
+def read_datasheet(filepath, **kwargs):
+    """
+    Read an exported datasheet, using its Parquet copy only when it was
+    written with the csv as it is now: export_datasheets gives the copy the
+    modification time of the csv, so a csv edited or replaced since then is
+    read instead. kwargs are passed to pandas.read_csv.
+    """
+    parquet_path = os.path.splitext(filepath)[0] + ".parquet"
+    if os.path.exists(parquet_path) and not kwargs and \
+            os.stat(parquet_path).st_mtime_ns == os.stat(filepath).st_mtime_ns:
+        return pd.read_parquet(parquet_path)
+    return pd.read_csv(filepath, **kwargs)
+
+class DatasheetWriter:
+    """
+    Stage datasheet saves and run them in one checked commit. Before
+    anything is saved, references between datasheets (e.g. StateLabelXID
+    values in stsim_StateClass) are checked against the staged datasheets
+    and the library. Datasheets are then saved one by one, each after the
+    datasheets it refers to, and the library file is restored from a .bak
+    copy if any save fails.
+
+    This does not batch the saves: each datasheet is still saved with its
+    own save_datasheet call, which runs one console import, so committing
+    costs the same as saving the datasheets one by one plus the backup copy.
+
+    Parameters
+    ----------
+    library : pysyncrosim.Library
+        Library the staged datasheets are saved to
+    """
+    def __init__(self, library):
+        self.library = library
+        self.staged = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.staged = []
+        return False
+
+    def stage(self, ssimObject, datasheetName, datasheet, **kwargs):
+        """
+        Stage a datasheet save. kwargs are passed to save_datasheet.
+        """
+        self.staged.append((ssimObject, datasheetName, datasheet, kwargs))
+
+    def _references(self, datasheetName, datasheet, datasheet_names):
+        # ID columns of a datasheet and the datasheet holding their names,
+        # e.g. FromStateClassID -> stsim_StateClass. Leading words are dropped
+        # until a datasheet matches, as in LibraryReader.name_table
+        references = {}
+        for column in datasheet.columns:
+            if not column.endswith("ID") or column in ("ScenarioID", "ProjectID"):
+                continue
+            words = re.findall(r"[A-Z][a-z0-9]*", column[:-2])
+            for start in range(len(words)):
+                parents = [name for name in datasheet_names
+                           if name.split("_", 1)[-1] == "".join(words[start:])
+                           and name != datasheetName]
+                parents.sort(key=lambda name: name.split("_")[0] != datasheetName.split("_")[0])
+                if parents:
+                    references[column] = parents[0]
+                    break
+        return references
+
+    @staticmethod
+    def _project_id(ssimObject):
+        # Project of a project or scenario save, None for library saves
+        project = getattr(ssimObject, "project", ssimObject)
+        return getattr(project, "pid", None)
+
+    def validate(self):
+        """
+        Check that the names in each ID column of the staged datasheets
+        exist in a staged datasheet or, for the same project, in the library.
+
+        Returns
+        -------
+        list of str
+            Problems found, empty if the staged datasheets are valid
+        """
+        problems = []
+        staged_names = {}
+        for _, datasheetName, datasheet, _ in self.staged:
+            if "Name" in datasheet.columns:
+                staged_names.setdefault(datasheetName, set()).update(
+                    datasheet["Name"].dropna().astype(str))
+
+        library_names = {}
+        with LibraryReader(self.library.location) as reader:
+            for ssimObject, datasheetName, datasheet, _ in self.staged:
+                references = self._references(datasheetName, datasheet,
+                                              set(staged_names) | reader.tables)
+                project_id = self._project_id(ssimObject)
+                for column, parent in references.items():
+                    # Numeric columns hold ids rather than names
+                    if pd.api.types.is_numeric_dtype(datasheet[column]):
+                        continue
+                    if (parent, project_id) not in library_names:
+                        names = set()
+                        if parent in reader.tables:
+                            where = {"ProjectID": project_id} if project_id is not None \
+                                and "ProjectID" in set(reader.columns(parent)["name"]) else None
+                            names = set(reader.read(parent, columns=["Name"], where=where,
+                                                    names=False)["Name"].astype(str))
+                        library_names[(parent, project_id)] = names
+                    known = staged_names.get(parent, set()) | library_names[(parent, project_id)]
+                    missing = set(datasheet[column].dropna().astype(str)) - known
+                    if missing:
+                        problems.append(datasheetName + "." + column + " values not in "
+                                        + parent + ": " + ", ".join(sorted(missing)))
+        return problems
+
+    def order(self):
+        """
+        Get the staged saves with each datasheet after the datasheets it
+        refers to, otherwise in the order they were staged.
+        """
+        staged_names = set(datasheetName for _, datasheetName, _, _ in self.staged)
+        depends = [set(self._references(datasheetName, datasheet, staged_names).values())
+                   for _, datasheetName, datasheet, _ in self.staged]
+        ordered = []
+        remaining = list(range(len(self.staged)))
+        while remaining:
+            waiting = set(self.staged[i][1] for i in remaining)
+            ready = [i for i in remaining if not depends[i] & waiting]
+            if not ready:
+                raise ValueError("Circular datasheet references: "
+                                 + ", ".join(sorted(waiting)))
+            ordered += ready
+            remaining = [i for i in remaining if i not in ready]
+        return [self.staged[i] for i in ordered]
+
+    def commit(self):
+        """
+        Validate the staged datasheets and save them in dependency order,
+        see order(). The library file is copied to a .bak file first. If a save
+        fails, the library is restored from it; either way the .bak file is
+        removed once the commit is done.
+
+        A .bak file left by a commit that was killed part way is not used or
+        removed: the commit stops so it can be restored or deleted by hand.
+        """
+        problems = self.validate()
+        if problems:
+            raise ValueError("Datasheets not saved:\n" + "\n".join(problems))
+        ordered = self.order()
+
+        backup = self.library.location + ".bak"
+        if os.path.exists(backup):
+            raise RuntimeError(backup + " was left by a commit that did not finish. "
+                               "Restore the library from it or delete it, then commit again.")
+        shutil.copy2(self.library.location, backup)
+        try:
+            for ssimObject, datasheetName, datasheet, kwargs in ordered:
+                ssimObject.save_datasheet(name = datasheetName, data = datasheet, **kwargs)
+        except Exception:
+            # The backup is kept if the library cannot be restored
+            shutil.copy2(backup, self.library.location)
+            os.remove(backup)
+            raise
+        finally:
+            self.staged = []
+        os.remove(backup)
 
 def finalize_datasheets(save, export, ssimObject, datasheetName, datasheet, 
-                        folder=CUSTOM_DEFINITIONS_DIR, csv_append = ""):
+                        folder=CUSTOM_DEFINITIONS_DIR, csv_append = "", writer=None):
     """
-    Finalize datasheet by writing to library and/or exporting to csv.
+    Finalize datasheet by writing to library and/or exporting to csv. The
+    csv is written in the background, see export_datasheets.
     
     Parameters
     ----------
@@ -113,18 +515,19 @@ def finalize_datasheets(save, export, ssimObject, datasheetName, datasheet,
         Folder to export csv to
     csv_append : str
         String to append to csv name
+    writer : DatasheetWriter, optional
+        Stage the save with this writer instead of saving now
     
     Returns
     -------
     None
     """
-    if save: 
+    if save and writer is not None:
+        writer.stage(ssimObject, datasheetName, datasheet)
+    elif save: 
         ssimObject.save_datasheet(name = datasheetName, data = datasheet)
     if export:
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        filepath = os.path.join(folder, datasheetName + csv_append + ".csv")
-        datasheet.to_csv(filepath, index = False, float_format="%.10f")
+        export_datasheets(datasheetName, datasheet, folder=folder, csv_append=csv_append)
 
 def create_project_folder(session, library, project, folder_name):
   """
@@ -150,6 +553,7 @@ def create_project_folder(session, library, project, folder_name):
         + " --name=\"" + folder_name + "\"" + " --tpid=" + str(project.pid)
   out = subprocess.run(command, stdout=subprocess.PIPE, shell=True)
   folder_id = re.findall(r'\d+', out.stdout.decode('utf-8'))[0]
+  _register_folder(library, folder_id, folder_name)
 
   return folder_id
 
@@ -179,6 +583,7 @@ def create_nested_folder(session, library, parent_folder_id, folder_name):
         + " --name=\"" + folder_name + "\"" + " --tfid=" + parent_folder_id
   out = subprocess.run(command, stdout=subprocess.PIPE, shell=True)
   folder_id = re.findall(r'\d+', out.stdout.decode('utf-8'))[0]
+  _register_folder(library, folder_id, folder_name, parent_folder_id)
 
   return folder_id
 
@@ -211,6 +616,208 @@ def add_scenario_to_folder(session, library, project, scenario, folder_id):
   subprocess.call(command, stdout=subprocess.PIPE, shell=True)
 
 
+class FolderMoveQueue:
+  """
+  Deferred scenario to folder moves. Moves are collected with add() while a
+  script saves scenarios and run by flush(), or on leaving a with block.
+
+  This does not batch the moves: the console moves one scenario per call,
+  so every move that is run still launches the console once. The queue only
+  removes moves that are not needed. A scenario added more than once is
+  moved once, to the last folder it was added to, and scenarios that are
+  already in their folder (e.g. when a library is rebuilt) are skipped.
+
+  Attributes
+  ----------
+  session : pysyncrosim.Session
+    pysyncrosim session object
+  library : pysyncrosim.Library
+    pysyncrosim library object
+  project : pysyncrosim.Project
+    pysyncrosim project object
+  pending : dict
+    Scenario id to (scenario name, folder id) of moves not yet run
+  """
+  def __init__(self, session, library, project):
+    self.session = session
+    self.library = library
+    self.project = project
+    self.pending = {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.flush()
+    return False
+
+  def add(self, scenario, folder_id):
+    """
+    Queue a scenario to be moved to a folder
+
+    Parameters
+    ----------
+    scenario : pysyncrosim.Scenario
+      pysyncrosim scenario object
+    folder_id : str
+      Folder id
+    """
+    self.pending.pop(scenario.sid, None)
+    self.pending[scenario.sid] = (scenario.name, str(folder_id))
+
+  def flush(self):
+    """
+    Run the queued moves one console call at a time and empty the queue.
+    The library tree is listed once first to find the scenarios that are
+    already in their folder. A failed move does not stop the others, but a
+    RuntimeError listing the failures is raised once all moves were tried.
+
+    Returns
+    -------
+    pandas.DataFrame
+      ScenarioID, Scenario, FolderID, Success and Message of each move
+    """
+    moves = {"ScenarioID": [], "Scenario": [], "FolderID": [],
+             "Success": [], "Message": []}
+    if not self.pending:
+      return pd.DataFrame(moves)
+
+    registry = folder_registry(self.session, self.library)
+    registry.refresh_scenarios()
+    console = os.path.join(self.session.location, "SyncroSim.Console.exe")
+    while self.pending:
+      sid, (name, folder_id) = next(iter(self.pending.items()))
+      del self.pending[sid]
+      if registry.scenario_folders.get(str(sid)) == folder_id:
+        success, message = True, "Already in folder"
+      else:
+        out = subprocess.run([console, "--move", "--scenario",
+                              "--lib=" + self.library.location, "--sid=" + str(sid),
+                              "--tfid=" + folder_id, "--tpid=" + str(self.project.pid)],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        success = out.returncode == 0
+        message = (out.stderr or out.stdout).decode("utf-8").strip()
+        if success:
+          registry.scenario_folders[str(sid)] = folder_id
+      moves["ScenarioID"].append(sid)
+      moves["Scenario"].append(name)
+      moves["FolderID"].append(folder_id)
+      moves["Success"].append(success)
+      moves["Message"].append(message)
+
+    moves = pd.DataFrame(moves)
+    failed = moves[~moves.Success]
+    if len(failed) > 0:
+      raise RuntimeError("Could not move " + str(len(failed)) + " scenario(s):\n"
+                         + "\n".join(move.Scenario + " (" + str(move.ScenarioID)
+                                      + ") to folder " + move.FolderID + ": "
+                                      + move.Message for _, move in failed.iterrows()))
+    return moves
+
+class ResultScenarioRegistry:
+  """
+  Index of the result scenarios of each parent scenario in a project. All
+  scenarios are listed with one console call; lookups are then served from
+  memory. Call refresh() after running scenarios to index the new results;
+  a lookup that finds no results refreshes the registry once itself.
+
+  Attributes
+  ----------
+  project : pysyncrosim.Project
+    pysyncrosim project object
+  parent_ids : dict
+    Parent scenario name to parent scenario id
+  results : dict
+    Parent scenario id to list of (result scenario id, time indexed) tuples,
+    oldest first
+  refreshed : pandas.Timestamp
+    Time of the last refresh
+  """
+  def __init__(self, myProject):
+    self.project = myProject
+    self.parent_ids = {}
+    self.results = {}
+    self.refreshed = None
+    self.refresh()
+
+  def refresh(self):
+    """
+    List the scenarios in the project and index parents and results not
+    already in the registry.
+
+    Returns
+    -------
+    list
+      Result scenario ids added by this refresh
+    """
+    scenarios = self.project.scenarios(optional = True)
+    # Column names differ between pysyncrosim versions (e.g. ScenarioId, ScenarioID)
+    scenarios = scenarios.rename(columns = lambda c: re.sub(r"[^a-z]", "", c.lower()))
+    scenarios = scenarios.rename(columns = {"id": "scenarioid"})
+    is_result = scenarios["isresult"] == "Yes"
+
+    parents = scenarios[~is_result]
+    self.parent_ids.update(zip(parents["name"], parents["scenarioid"].astype(int)))
+
+    indexed = set(sid for ids in self.results.values() for sid, _ in ids)
+    new_results = scenarios[is_result & ~scenarios["scenarioid"].isin(indexed)]
+    new_results = new_results.sort_values("scenarioid")
+    now = pd.Timestamp.now()
+    for sid, parent_id in zip(new_results["scenarioid"].astype(int),
+                              new_results["parentid"].astype(int)):
+      self.results.setdefault(parent_id, []).append((sid, now))
+
+    self.refreshed = now
+    return new_results["scenarioid"].astype(int).tolist()
+
+  def latest(self, scenario_name):
+    """
+    Get the id of the most recent result scenario of a parent scenario
+
+    Parameters
+    ----------
+    scenario_name : str
+      Name of the parent scenario
+
+    Returns
+    -------
+    int
+      Scenario id of the result scenario
+    """
+    parent_id = self.parent_ids.get(scenario_name)
+    if parent_id not in self.results:
+      # The scenario may have been created or run since the last refresh
+      self.refresh()
+      parent_id = self.parent_ids.get(scenario_name)
+    if parent_id not in self.results:
+      raise KeyError("No result scenarios found for " + scenario_name)
+    return self.results[parent_id][-1][0]
+
+_result_scenario_registries = {}
+
+def result_scenario_registry(myProject, refresh=False):
+  """
+  Get the shared result scenario registry of a project, building it on
+  first use
+
+  Parameters
+  ----------
+  myProject : pysyncrosim.Project
+    pysyncrosim project object
+  refresh : bool
+    Index result scenarios added since the registry was built
+
+  Returns
+  -------
+  ResultScenarioRegistry
+  """
+  key = (myProject.library.location, myProject.pid)
+  if key not in _result_scenario_registries:
+    _result_scenario_registries[key] = ResultScenarioRegistry(myProject)
+  elif refresh:
+    _result_scenario_registries[key].refresh()
+  return _result_scenario_registries[key]
+
 def get_result_scenario_id(myProject, scenario_name):
   """
   Get the scenario id of a result scenario
@@ -227,11 +834,7 @@ def get_result_scenario_id(myProject, scenario_name):
   int
     Scenario id of the result scenario
   """
-  myScenario = myProject.scenarios(name = scenario_name)
-  myResultScenarios = myScenario.results()
-  return myResultScenarios[
-      myResultScenarios["Name"].str.contains(scenario_name, regex=False)
-      ].ScenarioID.values[-1]
+  return result_scenario_registry(myProject).latest(scenario_name)
 
 # Load definitions ------------------------------------------------------------
 # This function loads definitions into an stsim sf library.
@@ -240,7 +843,10 @@ def load_definitions(project, datasheetFolder, tag="",
                      loadingOrder = None, cbmcfs3 = False):
   """
   Load definitions into an stsim sf library. Definitions to be loaded are 
-  stored as csvs in a definitions folder.
+  stored as csvs in a definitions folder. The csvs are read one at a time
+  and saved one at a time, in dependency order inferred from their ID
+  columns; references to names that are not defined raise an error before
+  anything is saved.
   
   Parameters
   ----------
@@ -251,7 +857,10 @@ def load_definitions(project, datasheetFolder, tag="",
   tag : str
     Tag to append to datasheet names
   loadingOrder : list
-    List of datasheet names in order to load
+    List of datasheet names to load. They are saved after the datasheets
+    they refer to, otherwise in this order
+  cbmcfs3 : bool
+    Whether to also load the stsimcbmcfs3 definitions
   
   Returns
   -------
@@ -280,7 +889,9 @@ def load_definitions(project, datasheetFolder, tag="",
     if cbmcfs3:
       loadingOrder += cbmcfs3_datasheets
 
-  # Loop through sheets in the definitions folder by loading order
+  # Stage sheets in the definitions folder, then save them one at a time in
+  # reference order
+  writer = DatasheetWriter(project.library)
   for datasheetName in loadingOrder:
 
     if (len(tag) > 0):
@@ -291,46 +902,52 @@ def load_definitions(project, datasheetFolder, tag="",
     definitionFile = os.path.join(datasheetFolder, definitionFileName)
 
     if (os.path.exists(definitionFile)):
-      myDatasheet = pd.read_csv(definitionFile)
-      project.save_datasheet(datasheetName, myDatasheet)
-
-# Functions for definitions.py -------------------------------------------------
-
-def find_top_forest_type_group(tertiary_stratum, primary_stratum):
-
-    num_threads = 6
-    client = Client(threads_per_worker = num_threads, n_workers = 1)
-    tertiary_stratum.rio.write_nodata(TERTIARY_STRATUM_NO_DATA_VALUE, inplace=True)
-    top_forest_group_dict = {PRIMARY_STRATUM_NAME_FIELD: [],
-                            "Top Forest Type Group": []}
+      myDatasheet = read_datasheet(definitionFile)
+      writer.stage(project, datasheetName, myDatasheet)
 
-    for stratum in primary_stratum[PRIMARY_STRATUM_NAME_FIELD].unique():
+  writer.commit()
 
-        primary_stratum_temp = primary_stratum[primary_stratum[PRIMARY_STRATUM_NAME_FIELD] == stratum]
-        aoi = primary_stratum_temp.geometry.values
-
-        def mask(block, aoi = aoi):
-            return block.rio.clip(aoi, drop = False)
-
-        temp = tertiary_stratum.rio.clip_box(*aoi.total_bounds)
-
-        out = temp.map_blocks(mask, template=temp)
-
-        output_filename = os.path.join(CUSTOM_INTERMEDIATES_DIR, f"tertiary-stratum-{stratum}-clip.tif")
-        out.rio.to_raster(output_filename, tiled=True, lock=Lock("rio", client=client),  windowed = True, overwrite= True, compress = 'lzw')
-
-        # Mask tertiary stratum raster
-        tertiary_stratum_clip = rxr.open_rasterio(output_filename)
-        tertiary_stratum_clip = tertiary_stratum_clip.astype(np.uint16).squeeze().to_numpy()
-        tertiary_stratum_clip = np.reshape(tertiary_stratum_clip, tertiary_stratum_clip.size)
-        tertiary_stratum_clip = tertiary_stratum_clip[tertiary_stratum_clip != TERTIARY_STRATUM_NO_DATA_VALUE]
-        top_forest_type_group = np.bincount(tertiary_stratum_clip).argmax()
-
-        top_forest_group_dict[PRIMARY_STRATUM_NAME_FIELD].append(stratum)
-        top_forest_group_dict["Top Forest Type Group"].append(top_forest_type_group)
+# Functions for definitions.py -------------------------------------------------
 
-    pd.DataFrame(top_forest_group_dict).to_csv(
-        os.path.join(CUSTOM_INTERMEDIATES_DIR, "top_forest_type_group.csv"), index=False)
+def pair_state_classes(srcClasses):
+  """
+  Pair every source state class with every other state class. Pairs are
+  ordered by source, then destination, in the order of srcClasses.
+  
+  Parameters
+  ----------
+  srcClasses : pandas.DataFrame
+    State classes with columns prefixed by src, including srcName and srcID
+    
+  Returns
+  -------
+  transitionTypes : pandas.DataFrame
+    The src columns, a matching dest column for each, and the transition
+    type Name and ID
+  """
+  nrows = len(srcClasses)
+  srcIDs = srcClasses['srcID'].to_numpy(dtype=np.int64)
+  
+  # Cross join: each source repeated once per destination, destinations tiled
+  srcRows = np.repeat(np.arange(nrows), nrows)
+  destRows = np.tile(np.arange(nrows), nrows)
+  
+  # Remove the rows with same source and destination Class
+  keep = srcIDs[srcRows] != srcIDs[destRows]
+  srcRows = srcRows[keep]
+  destRows = destRows[keep]
+  
+  transitionTypes = srcClasses.iloc[srcRows].copy()
+  for column in srcClasses.columns:
+    transitionTypes['dest' + column[3:]] = srcClasses[column].to_numpy()[destRows]
+  
+  # Transition Type IDs are the source and destination IDs written one after
+  # the other, e.g. srcID 12 and destID 3 give 123
+  destDigits = np.array([len(str(i)) for i in srcIDs], dtype=np.int64)
+  transitionTypes['Name'] = transitionTypes['srcName'] + "->" + transitionTypes['destName']
+  transitionTypes['ID'] = srcIDs[srcRows] * 10 ** destDigits[destRows] + srcIDs[destRows]
+  
+  return transitionTypes
 
 def generate_transition_types(stateClasses):
   """
@@ -363,28 +980,8 @@ def generate_transition_types(stateClasses):
   srcClasses.rename(columns={'StateLabelXID': 'srcClass'}, inplace=True)
   srcClasses = srcClasses[['srcClass', 'srcName', 'srcID']]
   
-  # Setup a dataframe with all combinations of to/from state classes
-  nrows = len(srcClasses)
-  transitionTypes = srcClasses.loc[srcClasses.index.repeat(nrows)]  
-  transitionTypes['destClass'] = ""
-  transitionTypes['destName'] = ""
-  transitionTypes['destID'] = np.nan
-  
-  for i in range(0, nrows):
-    for j in range(0, nrows):
-        row = ((i - 1) * nrows) + j
-        transitionTypes['destClass'].iloc[row] = srcClasses.iloc[j]['srcClass']
-        transitionTypes['destName'].iloc[row] = srcClasses.iloc[j]['srcName']
-        transitionTypes['destID'].iloc[row] = srcClasses.iloc[j]['srcID'].astype(int)
-
-  transitionTypes['destID'] = transitionTypes['destID'].astype(int)
-  
-  # Remove the rows with same source and destination Class
-  transitionTypes = transitionTypes[transitionTypes['srcID'] != transitionTypes['destID']]
-  
-  # Add columns with Name and ID for Transition Types. Note that TransitionTypeID = (srcID * 100) + destID
-  transitionTypes['Name'] = transitionTypes['srcName'] + "->" + transitionTypes['destName']
-  transitionTypes['ID'] = (transitionTypes['srcID'].astype(str) + transitionTypes['destID'].astype(str)).astype(int)
+  # All pairs of non-identical source and destination state classes
+  transitionTypes = pair_state_classes(srcClasses)
 
   # Write Transition Types back to library
   transitionTypesMinimalColumns = transitionTypes[['Name', 'ID']]
@@ -475,31 +1072,9 @@ def generate_transition_types_by_groups(stateClasses):
   srcClasses.rename(columns={'StateLabelXID': 'srcClass'}, inplace=True)
   srcClasses = srcClasses[['srcClass', 'srcName', 'srcName2', 'srcID']]
   
-  # Setup a dataframe with all combinations of to/from state classes
-  nrows = len(srcClasses)
-  transitionTypes = srcClasses.loc[srcClasses.index.repeat(nrows)]  
-  transitionTypes['destClass'] = ""
-  transitionTypes['destName'] = ""
-  transitionTypes['destName2'] = ""
-  transitionTypes['destID'] = np.nan
-
-  for i in range(0, nrows):
-    for j in range(0, nrows):
-        row = ((i - 1) * nrows) + j
-        transitionTypes['destClass'].iloc[row] = srcClasses.iloc[j]['srcClass']
-        transitionTypes['destName'].iloc[row] = srcClasses.iloc[j]['srcName']
-        transitionTypes['destName2'].iloc[row] = srcClasses.iloc[j]['srcName2'] # check this
-        transitionTypes['destID'].iloc[row] = srcClasses.iloc[j]['srcID'].astype(int)
-
-  transitionTypes['destID'] = transitionTypes['destID'].astype(int)
-  
-  # Remove the rows with same source and destination Class
-  transitionTypes = transitionTypes[transitionTypes['srcID'] != transitionTypes['destID']]
-  
-  # Add columns with Name and ID for Transition Types. Note that TransitionTypeID = (srcID * 100) + destID
-  transitionTypes['Name'] = transitionTypes['srcName'] + "->" + transitionTypes['destName']
-  transitionTypes['ID'] = (transitionTypes['srcID'].astype(str) + transitionTypes['destID'].astype(str)).astype(int)
-  
+  # All pairs of non-identical source and destination state classes
+  transitionTypes = pair_state_classes(srcClasses)
+
   transitionTypes.rename(columns={'Name': 'TransitionType', 'ID': 'TransitionTypeID'}, inplace=True)  
   
   # Associate Types with source Groups
@@ -838,201 +1413,6 @@ def assign_flow_group_multipliers(flowGroupsDF, stateClassID):
                         'DistributionFrequencyID']] 
 
 # Functions for building library ----------------------------------------
-def create_folder_structure(mySession, myLibrary, myProject):
-
-    folder_name_list = []
-    folder_id_list = []
-
-    fname = "Subscenarios"
-    subscenario_folder_id = create_project_folder(
-        mySession, myLibrary, myProject, folder_name=fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(subscenario_folder_id)
-
-    fname = "01 Run Control"
-    runcontrol_folder_id = create_nested_folder(mySession, myLibrary,
-        subscenario_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(runcontrol_folder_id)
-
-    fname = "02 Transition Pathways"
-    transpaths_folder_id = create_nested_folder(mySession, myLibrary,
-        subscenario_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(transpaths_folder_id)
-
-    fname = "03 Initial Conditions"
-    initconds_folder_id = create_nested_folder(mySession, myLibrary,
-        subscenario_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(initconds_folder_id)
-
-    fname = "Landscape"
-    ls_initconds_folder_id = create_nested_folder(mySession, myLibrary,
-        initconds_folder_id, fname)
-    folder_name_list.append(fname + " [Initial Conditions]")
-    folder_id_list.append(ls_initconds_folder_id)
-
-    fname = "Single Cell"
-    sc_initconds_folder_id = create_nested_folder(mySession, myLibrary,
-        initconds_folder_id, fname)
-    folder_name_list.append(fname + " [Initial Conditions]")
-    folder_id_list.append(sc_initconds_folder_id)
-
-    fname = "04 ST-Sim Output Options"
-    outoptions_folder_id = create_nested_folder(mySession, myLibrary,
-        subscenario_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(outoptions_folder_id)
-
-    fname = "05 Transition Multipliers"
-    transmults_folder_id = create_nested_folder(mySession, myLibrary,
-        subscenario_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(transmults_folder_id)
-
-    fname = "Landscape"
-    ls_transmults_folder_id = create_nested_folder(mySession, myLibrary,
-        transmults_folder_id, fname)
-    folder_name_list.append(fname + " [Transition Multipliers]")
-    folder_id_list.append(ls_transmults_folder_id)
-
-    fname = "Single Cell"
-    sc_transmults_folder_id = create_nested_folder(mySession, myLibrary,
-        transmults_folder_id, fname)
-    folder_name_list.append(fname + " [Transition Multipliers]")
-    folder_id_list.append(sc_transmults_folder_id)
-
-    fname = "06 State Attribute Values"
-    stateattrvals_folder_id = create_nested_folder(mySession, myLibrary,
-        subscenario_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(stateattrvals_folder_id)
-
-    fname = "07 Stocks and Flows"
-    stocks_flows_folder_id = create_nested_folder(mySession, myLibrary,
-        subscenario_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(stocks_flows_folder_id)
-
-    fname = "01 Flow Pathways"
-    flowpaths_folder_id = create_nested_folder(mySession, myLibrary,
-        stocks_flows_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(flowpaths_folder_id)
-
-    fname = "02 Initial Stocks"
-    initialstock_folder_id = create_nested_folder(mySession, myLibrary,
-        stocks_flows_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(initialstock_folder_id)
-
-    fname = "03 ST-Sim SF Output Options"
-    sfoutoptions_folder_id = create_nested_folder(mySession, myLibrary,
-        stocks_flows_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(sfoutoptions_folder_id)
-
-    fname = "04 ST-Sim SF Output Filters"
-    sfoutfilters_folder_id = create_nested_folder(mySession, myLibrary,
-        stocks_flows_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(sfoutfilters_folder_id)
-
-    fname = "05 Stock Group Membership"
-    stockgroup_folder_id = create_nested_folder(mySession, myLibrary,
-        stocks_flows_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(stockgroup_folder_id)
-
-    fname = "06 Flow Group Membership"
-    flowgroup_folder_id = create_nested_folder(mySession, myLibrary,
-        stocks_flows_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(flowgroup_folder_id)
-
-    fname = "07 Flow Multipliers"
-    flowmults_folder_id = create_nested_folder(mySession, myLibrary,
-        stocks_flows_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(flowmults_folder_id)
-
-    fname = "08 Flow Order"
-    floworder_folder_id = create_nested_folder(mySession, myLibrary,
-        stocks_flows_folder_id, fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(floworder_folder_id)
-
-    fname = "Single Cell Scenarios"
-    sc_scenario_folder_id = create_project_folder(
-        mySession, myLibrary, myProject, folder_name=fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(sc_scenario_folder_id)
-
-    fname = "Base"
-    sc_base_folder_id = create_nested_folder(mySession, myLibrary,
-        sc_scenario_folder_id, fname)
-    folder_name_list.append(fname + " [Single Cell]")
-    folder_id_list.append(sc_base_folder_id)
-
-    fname = "LULC Change"
-    sc_lulc_folder_id = create_nested_folder(mySession, myLibrary,
-        sc_scenario_folder_id, fname)
-    folder_name_list.append(fname + " [Single Cell]")
-    folder_id_list.append(sc_lulc_folder_id)
-
-    fname = "No LULC Change"
-    sc_nolulc_folder_id = create_nested_folder(mySession, myLibrary,
-        sc_scenario_folder_id, fname)
-    folder_name_list.append(fname + " [Single Cell]")
-    folder_id_list.append(sc_nolulc_folder_id)
-
-    fname = "Init C Stock Equilibrium"
-    eqm_scenario_folder_id = create_nested_folder(mySession, myLibrary, 
-        sc_nolulc_folder_id, fname)
-    folder_name_list.append(fname + " [No LULC; Single Cell]")
-    folder_id_list.append(eqm_scenario_folder_id)
-
-    fname = "Init C Stock 0"
-    init0_scenario_folder_id = create_nested_folder(mySession, myLibrary, 
-        sc_nolulc_folder_id, fname)
-    folder_name_list.append(fname + " [No LULC; Single Cell]")
-    folder_id_list.append(init0_scenario_folder_id)
-
-    fname = "Spinup"
-    sc_spinup_folder_id = create_nested_folder(mySession, myLibrary,
-        sc_scenario_folder_id, fname)
-    folder_name_list.append(fname + " [Single Cell]")
-    folder_id_list.append(sc_spinup_folder_id)
-    
-    fname = "Landscape Scenarios"
-    ls_scenario_folder_id = create_project_folder(
-        mySession, myLibrary, myProject, folder_name=fname)
-    folder_name_list.append(fname)
-    folder_id_list.append(ls_scenario_folder_id)
-
-    fname = "Base"
-    ls_base_folder_id = create_nested_folder(mySession, myLibrary,
-        ls_scenario_folder_id, fname)
-    folder_name_list.append(fname + " [Landscape]")
-    folder_id_list.append(ls_base_folder_id)
-
-    fname = "Full Resolution 2001-2022"
-    ls_fullres_folder_id = create_nested_folder(mySession, myLibrary,
-        ls_scenario_folder_id, fname)
-    folder_name_list.append(fname + " [Landscape]")
-    folder_id_list.append(ls_fullres_folder_id)
-
-    folder_ids = pd.DataFrame({"folder_name": folder_name_list,
-                               "folder_id": folder_id_list})
-    folder_ids.to_csv(os.path.join(CUSTOM_INTERMEDIATES_DIR,
-                                   "folder_ids.csv"), index=False)
-    
-def retrieve_folder_id(name):
-    folder_ids = pd.read_csv(os.path.join(CUSTOM_INTERMEDIATES_DIR, "folder_ids.csv"))
-    folder_id = str(folder_ids[folder_ids.folder_name == name].folder_id.iloc[0])
-    return folder_id
-
 def list_folders_in_library(session, library):
     """
     List folders in a library
@@ -1056,7 +1436,562 @@ def list_folders_in_library(session, library):
 
     return out
 
+class FolderRegistry:
+    """
+    Index of the folders in a library by id, full path and name. The library
+    is listed once; folders created afterwards with create_project_folder or
+    create_nested_folder are added as they are created.
+
+    Attributes
+    ----------
+    names : dict
+        Folder id to folder name
+    parents : dict
+        Folder id to parent folder id, None for folders in a project
+    by_path : dict
+        Full folder path, with names separated by "/", to folder id
+    by_name : dict
+        Folder name to list of folder ids
+    scenario_folders : dict
+        Scenario id to id of the folder containing it, for scenarios in a
+        folder
+    """
+    def __init__(self, session, library):
+        self.session = session
+        self.library = library
+        self.refresh()
+
+    def refresh(self):
+        """
+        List the folders in the library and rebuild the indexes.
+        """
+        self.names = {}
+        self.parents = {}
+        self.by_path = {}
+        self.by_name = {}
+
+        folders = list_folders_in_library(self.session, self.library)
+        # Column names differ between SyncroSim versions (e.g. ID, Id, FolderId)
+        folders = folders.rename(columns=lambda c: re.sub(r"[^a-z]", "", c.lower()))
+        folders = folders.rename(columns={"folderid": "id"})
+        parents = self._list_library_tree()
+        # Children can be listed before their parent, so paths are only
+        # built once every folder is known
+        for folder_id, name in zip(folders["id"].astype(str), folders["name"]):
+            self.names[folder_id] = name
+            self.parents[folder_id] = parents.get(folder_id)
+        for folder_id in self.names:
+            self._index(folder_id)
+
+    def refresh_scenarios(self):
+        """
+        List the library tree again to update scenario_folders.
+        """
+        self._list_library_tree()
+
+    def _list_library_tree(self):
+        # Parents are only given by the indentation of the library tree
+        command = "\"" + os.path.join(self.session.location, "SyncroSim.Console.exe\"") \
+            + " --list --library --tree --lib=\"" + self.library.location + "\""
+        out = subprocess.run(command, stdout=subprocess.PIPE, shell=True)
+        parents = {}
+        self.scenario_folders = {}
+        stack = []
+        for line in out.stdout.decode("utf-8").splitlines()[1:]:
+            line = line.replace("|", " ")
+            match = re.search(r"\+- \**(\w+)\** \[(\d+)\]", line)
+            if match is None:
+                continue
+            level = len(line) - len(line.lstrip())
+            item, item_id = match.groups()
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            parent_id = stack[-1][2] if stack and stack[-1][1] == "Folder" else None
+            if item == "Folder":
+                parents[item_id] = parent_id
+            elif item == "Scenario" and parent_id is not None:
+                self.scenario_folders[item_id] = parent_id
+            stack.append((level, item, item_id))
+
+        return parents
+
+    def add(self, folder_id, name, parent_id=None):
+        """
+        Add a folder to the indexes. The parent must already be indexed.
+        """
+        folder_id = str(folder_id)
+        self.names[folder_id] = name
+        self.parents[folder_id] = None if parent_id is None else str(parent_id)
+        self._index(folder_id)
+
+    def _index(self, folder_id):
+        self.by_name.setdefault(self.names[folder_id], []).append(folder_id)
+        self.by_path[self.path(folder_id)] = folder_id
+
+    def path(self, folder_id):
+        """
+        Get the full path of a folder, with names separated by "/".
+        """
+        names = []
+        while folder_id is not None:
+            names.insert(0, self.names[folder_id])
+            folder_id = self.parents.get(folder_id)
+        return "/".join(names)
+
+    def get(self, path):
+        """
+        Get the id of a folder from its full path, or from its name if no
+        other folder has the same name.
+        """
+        if path in self.by_path:
+            return self.by_path[path]
+        folder_ids = self.by_name.get(path, [])
+        if len(folder_ids) != 1:
+            raise KeyError(("No" if not folder_ids else "More than one")
+                           + " folder named " + path)
+        return folder_ids[0]
+
+    def find(self, text):
+        """
+        Get the id of the first folder whose name contains text.
+        """
+        for folder_id, name in sorted(self.names.items(), key=lambda f: int(f[0])):
+            if text in name:
+                return folder_id
+        raise KeyError("No folder name contains " + text)
+
+_folder_registries = {}
+
+def folder_registry(session, library, refresh=False):
+    """
+    Get the shared folder registry of a library, building it on first use.
+
+    Parameters
+    ----------
+    session : pysyncrosim.Session
+        pysyncrosim session object
+    library : pysyncrosim.Library
+        pysyncrosim library object
+    refresh : bool, optional
+        List the library folders again, e.g. after folders were changed
+        outside this script. The default is False.
+
+    Returns
+    -------
+    FolderRegistry
+        Registry of the library folders
+    """
+    registry = _folder_registries.get(library.location)
+    if registry is None:
+        registry = _folder_registries[library.location] = FolderRegistry(session, library)
+    elif refresh:
+        registry.refresh()
+
+    return registry
+
+def _register_folder(library, folder_id, name, parent_id=None):
+    # Keep the shared registry of the library, if any, in step with new folders
+    registry = _folder_registries.get(library.location)
+    if registry is not None:
+        registry.add(folder_id, name, parent_id)
+
+class BuildManifest:
+    """
+    Content hashes of the inputs of each step of a library build, kept in a
+    JSON file so unchanged steps can be skipped on the next build. A step is
+    rebuilt when the hash of its inputs differs from the recorded one, and
+    its hash is recorded once it succeeds.
+
+    The manifest also records the size and modification time of the library
+    file it describes. If the library was changed or replaced since, the
+    build is not incremental: incremental is set to False and every step is
+    rebuilt, so the library should be created again from scratch.
+
+    Parameters
+    ----------
+    manifest_file : str
+        Path of the JSON manifest
+    incremental : bool
+        Skip steps whose inputs are unchanged. When False every step is
+        rebuilt and the manifest is started over.
+    library_file : str, optional
+        Path of the library file built
+    """
+    def __init__(self, manifest_file, incremental=True, library_file=None):
+        self.manifest_file = manifest_file
+        self.library_file = library_file
+        self.incremental = incremental
+        self.hashes = {}
+        if incremental and os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                manifest = json.load(f)
+            if manifest.get("library") != self._library_stamp():
+                print("The library was changed since the last build; rebuilding it from scratch")
+                self.incremental = False
+            else:
+                self.hashes = manifest["steps"]
+        self.rebuilt = []
+        self.skipped = []
+
+    def _library_stamp(self):
+        if self.library_file is None or not os.path.exists(self.library_file):
+            return None
+        stat = os.stat(self.library_file)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    @staticmethod
+    def digest(*inputs):
+        """
+        Hash build inputs. Paths of existing files are hashed by name and
+        content, DataFrames by content and anything else by its repr.
+        """
+        sha = hashlib.sha1()
+        for value in inputs:
+            if isinstance(value, str) and os.path.isfile(value):
+                sha.update(value.encode("utf-8"))
+                with open(value, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        sha.update(chunk)
+            elif isinstance(value, pd.DataFrame):
+                sha.update(pd.util.hash_pandas_object(value).values.tobytes())
+                sha.update(repr(list(value.columns)).encode("utf-8"))
+            else:
+                sha.update(repr(value).encode("utf-8"))
+        return sha.hexdigest()
+
+    def needs_build(self, step, digest):
+        """
+        Check whether a step has to be rebuilt, and note it in the report.
+        """
+        if self.incremental and self.hashes.get(step) == digest:
+            self.skipped.append(step)
+            return False
+        self.rebuilt.append(step)
+        return True
+
+    def built(self, step, digest):
+        """
+        Record the input hash of a step that was built and save the manifest.
+        """
+        self.hashes[step] = digest
+        self.save()
+
+    def save(self):
+        """
+        Save the manifest with the current state of the library file. Call
+        it once the build is done, as the library can change after the last
+        step is recorded.
+        """
+        manifest_dir = os.path.dirname(self.manifest_file)
+        if manifest_dir and not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+        with open(self.manifest_file, "w") as f:
+            json.dump({"library": self._library_stamp(), "steps": self.hashes},
+                      f, indent=2, sort_keys=True)
+
+    def built_moves(self, moves):
+        """
+        Record the folder moves that succeeded, as returned by
+        FolderMoveQueue.flush.
+        """
+        for _, move in moves[moves.Success].iterrows():
+            self.built(move.Scenario + " / folder", self.digest(str(move.FolderID)))
+
+    def report(self):
+        """
+        Print the steps rebuilt and the number of steps skipped.
+        """
+        print("Rebuilt " + str(len(self.rebuilt)) + " step(s), skipped "
+              + str(len(self.skipped)) + " unchanged step(s)")
+        for step in self.rebuilt:
+            print("  " + step)
+
+def build_subscenario(build, project, scenario_name, datasheets,
+                      folder_moves=None, folder_id=None):
+    """
+    Save the datasheets of a subscenario from csv files, skipping those
+    whose csv is unchanged since the last build. Scenarios whose move to
+    the folder is not recorded in the build, e.g. because it failed, are
+    queued to be moved to it even when no datasheet changed.
+
+    Parameters
+    ----------
+    build : BuildManifest
+        Manifest of the library build
+    project : pysyncrosim.Project
+        pysyncrosim project object
+    scenario_name : str
+        Name of the scenario
+    datasheets : list of tuple
+        (datasheet name, csv path) of each datasheet to save
+    folder_moves : FolderMoveQueue, optional
+        Queue of folder moves
+    folder_id : str, optional
+        Folder to move the scenario to
+
+    Returns
+    -------
+    list of str
+        Names of the datasheets saved
+    """
+    steps = [(scenario_name + " / " + datasheet_name, datasheet_name, filepath,
+              build.digest(filepath)) for datasheet_name, filepath in datasheets]
+    steps = [step for step in steps if build.needs_build(step[0], step[3])]
+    # Recorded by BuildManifest.built_moves once the move has run
+    move = folder_moves is not None and \
+        build.needs_build(scenario_name + " / folder", build.digest(str(folder_id)))
+    if not steps and not move:
+        return []
+
+    scenario = project.scenarios(scenario_name)
+    for step, datasheet_name, filepath, digest in steps:
+        scenario.save_datasheet(datasheet_name, read_datasheet(filepath))
+        build.built(step, digest)
+
+    if move:
+        folder_moves.add(scenario, folder_id)
+
+    return [step[1] for step in steps]
+
+# Functions for forest group crosswalk ----------------------------------------
+def _file_sha1(filepath):
+    sha1 = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+class ForestGroupCrosswalk:
+    """
+    Mappings between CBM forest groups, Nestweb forest state classes and
+    BEC variants, compiled from nestweb_to_cbm_forest_groups.csv. Origins
+    are the Nestweb forest state classes that have a CBM forest group of
+    their own; each BEC variant of Forest:Unknown takes the origin that
+    shares its CBM forest group.
+    """
+
+    def __init__(self, origins, cbm_to_nestweb, variant_origin):
+        self.origins = list(origins)
+        self.cbm_to_nestweb = dict(cbm_to_nestweb)
+        self.variant_origin = dict(variant_origin)
+        self.cbm_classes = list(dict.fromkeys(self.cbm_to_nestweb))
+        self.variants = list(self.variant_origin)
+
+    def to_nestweb(self, state_classes):
+        """Map a Series of CBM forest state classes to Nestweb origins."""
+        return state_classes.map(self.cbm_to_nestweb)
+
+    def origin_of(self, strata):
+        """Map a Series of BEC variants to Nestweb origins."""
+        return strata.map(self.variant_origin)
+
+    def variant_origins(self, stratum_column="StratumID",
+                        state_class_column="StateClassID"):
+        """Return the BEC variant to origin table for joining."""
+        return pd.DataFrame({stratum_column: self.variants,
+                             state_class_column: [self.variant_origin[v] for v in self.variants]})
+
+def load_forest_group_crosswalk(filepath=os.path.join(CUSTOM_CARBON_DATA_DIR,
+                                                      "nestweb_to_cbm_forest_groups.csv"),
+                                cache_dir=FOREST_GROUP_CROSSWALK_CACHE_DIR):
+    """
+    Load the forest group crosswalk, reusing the compiled mappings cached
+    for the file while its SHA-1 hash is unchanged. Each source file has
+    one cache file, which is overwritten when the source file changes.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to nestweb_to_cbm_forest_groups.csv
+    cache_dir : str
+        Folder to store the compiled mappings in
+
+    Returns
+    -------
+    ForestGroupCrosswalk
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    source_path = os.path.abspath(filepath)
+    cache_path = os.path.join(cache_dir,
+                              os.path.splitext(os.path.basename(source_path))[0] + "-"
+                              + hashlib.sha1(source_path.encode("utf-8")).hexdigest()[:12]
+                              + ".json")
+    digest = _file_sha1(filepath)
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached["sha1"] == digest:
+                return ForestGroupCrosswalk(**cached["crosswalk"])
+        except (ValueError, KeyError, TypeError):
+            pass
+
+    crosswalk = pd.read_csv(filepath, encoding="utf-8-sig")
+    origin_rows = crosswalk[crosswalk["BEC Variant"].isna()]
+    variant_rows = crosswalk.dropna(subset=["BEC Variant"])
+    cbm_to_nestweb = dict(zip(origin_rows["CBM Forest State Class"],
+                              origin_rows["Nestweb Forest State Class"]))
+    compiled = {"origins": origin_rows["Nestweb Forest State Class"].unique().tolist(),
+                "cbm_to_nestweb": cbm_to_nestweb,
+                "variant_origin": dict(zip(variant_rows["BEC Variant"],
+                                           variant_rows["CBM Forest State Class"].map(cbm_to_nestweb)))}
+
+    _write_json(cache_path, {"sha1": digest, "crosswalk": compiled})
+
+    return ForestGroupCrosswalk(**compiled)
+
 # Functions for extracting results ----------------------------------------
+class LibraryReader:
+    """
+    Read-only access to the datasheet tables of a SyncroSim library (.ssim),
+    which is a SQLite database. Filters and column selection are run by
+    SQLite, so only the requested rows and columns are loaded, and ID
+    columns are joined to the Name of the row they refer to.
+
+    Parameters
+    ----------
+    library_path : str
+        Path to the .ssim library file
+    """
+    def __init__(self, library_path):
+        uri = pathlib.Path(os.path.abspath(library_path)).as_uri() + "?mode=ro"
+        self.connection = sqlite3.connect(uri, uri=True)
+        self._columns = {}
+        self.tables = set(row[0] for row in self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        self.connection.close()
+
+    def columns(self, table):
+        """
+        Get the columns of a table as a DataFrame with name, type and pk
+        (as given by PRAGMA table_info).
+        """
+        if table not in self.tables:
+            raise KeyError("No table " + table + " in library")
+        if table not in self._columns:
+            self._columns[table] = pd.read_sql(
+                "PRAGMA table_info(\"" + table + "\")", self.connection)
+        return self._columns[table]
+
+    def name_table(self, datasheet, column):
+        """
+        Find the table holding the names of the values of an integer column,
+        e.g. stsim_StateClass for FromStateClassID or TransferToStateClassID,
+        and core_DistributionType for DistributionType. Leading words of the
+        column name are dropped until a table matches, and tables of the same
+        package as the datasheet are preferred.
+
+        Returns
+        -------
+        str or None
+            Table name, or None if the column does not refer to named rows
+        """
+        types = dict(zip(self.columns(datasheet)["name"], self.columns(datasheet)["type"]))
+        if column in ("ScenarioID", "ProjectID") or "INT" not in types[column].upper():
+            return None
+        words = re.findall(r"[A-Z][a-z0-9]*", re.sub(r"ID$", "", column))
+        for start in range(len(words)):
+            base = "".join(words[start:])
+            candidates = sorted(table for table in self.tables
+                                if table.split("_", 1)[-1] == base and table != datasheet
+                                and {base + "ID", "Name"} <= set(self.columns(table)["name"]))
+            candidates.sort(key=lambda table: table.split("_")[0] != datasheet.split("_")[0])
+            if candidates:
+                return candidates[0]
+        return None
+
+    def read(self, datasheet, scenario_id=None, columns=None, where=None, names=True):
+        """
+        Read rows of a datasheet table.
+
+        Parameters
+        ----------
+        datasheet : str
+            Datasheet name, e.g. "stsimsf_OutputStock"
+        scenario_id : int or list of int, optional
+            Only read rows of these scenarios
+        columns : list of str, optional
+            Columns to read. The default is all columns except the row id,
+            ScenarioID and ProjectID.
+        where : dict, optional
+            Column to value, or list of values, that rows must match. None
+            matches missing values. When names is True, string values of ID
+            columns are matched against names.
+        names : bool, optional
+            Show ID columns as names, like datasheets exported with
+            pysyncrosim. The default is True.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Datasheet rows. Integer columns are nullable Int64 and ID columns
+            shown as names are strings.
+        """
+        info = self.columns(datasheet)
+        types = dict(zip(info["name"], info["type"].str.upper()))
+        if columns is None:
+            columns = [c for c, pk in zip(info["name"], info["pk"])
+                       if not pk and c not in ("ScenarioID", "ProjectID")]
+        where = dict(where or {})
+        if scenario_id is not None:
+            where["ScenarioID"] = scenario_id
+        unknown = [c for c in list(columns) + list(where) if c not in types]
+        if unknown:
+            raise KeyError("No column " + ", ".join(unknown) + " in " + datasheet)
+
+        # Join each ID column to the table with its names
+        name_columns = {}
+        joins = []
+        if names:
+            for column in dict.fromkeys(list(columns) + list(where)):
+                table = self.name_table(datasheet, column)
+                if table is not None:
+                    alias = "n" + str(len(joins))
+                    key = table.split("_", 1)[-1] + "ID"
+                    joins.append("LEFT JOIN \"%s\" AS %s ON t.\"%s\" = %s.\"%s\""
+                                 % (table, alias, column, alias, key))
+                    name_columns[column] = alias + ".\"Name\""
+
+        select = ", ".join("%s AS \"%s\"" % (name_columns.get(c, "t.\"%s\"" % c), c)
+                           for c in columns)
+        conditions = []
+        params = []
+        for column, values in where.items():
+            values = list(values) if isinstance(values, (list, tuple, set, np.ndarray, pd.Series)) \
+                else [values]
+            by_name = column in name_columns and any(isinstance(v, str) for v in values)
+            target = name_columns[column] if by_name else "t.\"%s\"" % column
+            values = [v.item() if isinstance(v, np.generic) else v for v in values]
+            matches = []
+            if any(v is None for v in values):
+                matches.append(target + " IS NULL")
+            values = [v for v in values if v is not None]
+            if values:
+                matches.append(target + " IN (" + ", ".join("?" * len(values)) + ")")
+                params += values
+            conditions.append("(" + (" OR ".join(matches) or "0") + ")")
+
+        query = "SELECT " + select + " FROM \"" + datasheet + "\" AS t " + " ".join(joins)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        data = pd.read_sql(query, self.connection, params=params)
+
+        for column in columns:
+            if column not in name_columns and "INT" in types[column]:
+                data[column] = data[column].astype("Int64")
+        return data
+
 def convert_stock_outputs_to_sav(myProject, scenarioName, initial_stock_data, 
                                  spinup_end_year=2001):
     """
@@ -1077,11 +2012,11 @@ def convert_stock_outputs_to_sav(myProject, scenarioName, initial_stock_data,
         DataFrame containing State Attribute Values
     """
     result_id = get_result_scenario_id(myProject, scenarioName)
-    result_scenario = myProject.scenarios(sid = result_id)
-    stock_outputs = result_scenario.datasheets(name = "stsimsf_OutputStock")
-
-    stock_outputs = stock_outputs[stock_outputs["Timestep"] == spinup_end_year]
-    stock_outputs = stock_outputs.drop(columns = ["Timestep", "Iteration"])
+    # Only read the stocks at the end of the spinup
+    with LibraryReader(myProject.library.location) as reader:
+        stock_outputs = reader.read("stsimsf_OutputStock", scenario_id = result_id,
+                                    columns = ["StateClassID", "StockGroupID", "Amount"],
+                                    where = {"Timestep": spinup_end_year})
 
     # Create SAV datasheet
     myDatasheet = stock_outputs.copy()
@@ -1101,7 +2036,9 @@ def retrieve_generate_multipliers_outputs(myProject,
                                           FM_datasheet_name="stsimsf_FlowMultiplier",
                                           FP_datasheet_name="stsimsf_FlowPathway"):
   """
-  Retrieve the outputs from the Generate Multipliers tool
+  Retrieve the outputs from the Generate Multipliers tool. Each datasheet is
+  read for all result scenarios with one query on the library file; flow
+  pathways shared between result scenarios are kept once.
 
   Parameters
   ----------
@@ -1121,22 +2058,53 @@ def retrieve_generate_multipliers_outputs(myProject,
   data : list of pandas.DataFrames
     List of DataFrames containing the results from the CBM-CFS3 Model run
   """
-  for sid in result_scenario_ids:
-      myResultScenario = myProject.scenarios(sid=sid)
-      sav = myResultScenario.datasheets(name = SAV_datasheet_name)
-      fm = myResultScenario.datasheets(name = FM_datasheet_name)
-      fp = myResultScenario.datasheets(name = FP_datasheet_name)
-      if sid == result_scenario_ids[0]:
-          sav_all = sav
-          fm_all = fm
-          fp_all = fp
-      else:
-          sav_all = pd.concat([sav_all, sav])
-          fm_all = pd.concat([fm_all, fm])
-          fp_all = fp_all.merge(fp, how="outer")
+  ds_names = [SAV_datasheet_name, FM_datasheet_name, FP_datasheet_name]
+
+  with LibraryReader(myProject.library.location) as reader:
+    sav_all, fm_all, fp_all = [reader.read(ds_name, scenario_id=list(result_scenario_ids))
+                               for ds_name in ds_names]
+
+  fp_all = fp_all.drop_duplicates(ignore_index=True)
 
   return [sav_all, fm_all, fp_all]
 
+def expand_forest_unknown(data, forest_groups):
+    """
+    Map spinup outputs from CBM forest groups to Nestweb forest origins and
+    add a copy for each BEC variant of Forest:Unknown, taken from the origin
+    of that variant. Works on datasheets keyed by StateClassID/StratumID or
+    FromStateClassID/FromStratumID.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        State attribute values, flow multipliers or flow pathways
+    forest_groups : ForestGroupCrosswalk
+        Forest group crosswalk
+
+    Returns
+    -------
+    pandas.DataFrame
+        Rows for the forest origins followed by the Forest:Unknown rows
+    """
+    stateClassColumn = "FromStateClassID" \
+        if "FromStateClassID" in data.columns.tolist() else "StateClassID"
+    stratumColumn = stateClassColumn.replace("StateClassID", "StratumID")
+
+    # Only keep values in data that are contained in the crosswalk
+    data = data[data[stateClassColumn].isin(forest_groups.cbm_classes)]
+    data[stateClassColumn] = forest_groups.to_nestweb(data[stateClassColumn])
+    data[stratumColumn] = np.NaN
+
+    # One row per matching BEC variant
+    variants = forest_groups.variant_origins(stratum_column="Variant",
+                                             state_class_column=stateClassColumn)
+    forest_unknown_data = data.merge(variants, on=stateClassColumn)
+    forest_unknown_data[stateClassColumn] = STATE_CLASS_FOREST_UNKNOWN
+    forest_unknown_data[stratumColumn] = forest_unknown_data.pop("Variant")
+
+    return pd.concat([data, forest_unknown_data[data.columns]])
+
 def convert_output_for_forecast(data):
     for i in range(len(data)):
         stateClassColumn = "FromStateClassID" \
@@ -1195,3 +2163,361 @@ def save_spinup_flow_results(data, origin, ds_names, csv_suffix,
           data[i] = data[i][data[i].TransitionGroupID.isin(transition_groups)]
 
       data[i].to_csv(filepath,index=False)
+
+# Functions for remapping rasters ----------------------------------------
+class RemapLUT:
+    """
+    Lookup table for remapping integer raster IDs. IDs from offset to
+    offset + len(lut) - 1 are remapped by indexing; all others get default.
+    """
+
+    def __init__(self, lut, offset, default):
+        self.lut = lut
+        self.offset = offset
+        self.default = default
+
+    def apply(self, values):
+        """Remap an array of IDs, reusing the index buffer for the result."""
+        index = values.astype(np.int64) - self.offset
+        outside = (index < 0) | (index >= len(self.lut))
+        remapped = np.take(self.lut, index, mode="clip", out=index)
+        remapped[outside] = values[outside] if self.default is None else self.default
+        return remapped
+
+def compile_remap_lut(mapping, valid=None, fill=-9999):
+    """
+    Compile an ID mapping into a RemapLUT
+
+    Parameters
+    ----------
+    mapping : dict
+        Old ID to new ID. IDs not in the mapping keep their value
+    valid : list
+        IDs allowed after remapping; other values become fill. If None,
+        all values are allowed
+    fill : int
+        Value for IDs that are not valid after remapping
+
+    Returns
+    -------
+    RemapLUT
+    """
+    keys = list(mapping) + (list(valid) if valid is not None else [])
+    low, high = int(min(keys)), int(max(keys))
+    lut = np.arange(low, high + 1, dtype=np.int64)
+    lut[np.array(list(mapping), dtype=np.int64) - low] = list(mapping.values())
+    if valid is None:
+        return RemapLUT(lut, low, None)
+
+    lut[~np.isin(lut, list(valid))] = fill
+    return RemapLUT(lut, low, fill)
+
+def raster_windows(width, height, block_size):
+    """Yield the windows of a raster in blocks of block_size cells."""
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield windows.Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+def remap_rasters_by_block(input_paths, output_path, remap, profile=None, block_size=512):
+    """
+    Build a raster from aligned input rasters one block at a time, so extra
+    memory is bounded by the block size
+
+    Parameters
+    ----------
+    input_paths : list
+        Paths of the aligned input rasters
+    output_path : str
+        Path of the output raster
+    remap : function
+        Takes one block array per input raster and returns the output block
+    profile : dict
+        Rasterio profile of the output. Defaults to that of the first input
+    block_size : int
+        Block width and height in cells
+
+    Returns
+    -------
+    None
+    """
+    sources = [rio.open(path) for path in input_paths]
+    try:
+        if profile is None:
+            profile = sources[0].profile
+        with rio.open(output_path, "w", **profile) as dst:
+            for window in raster_windows(dst.width, dst.height, block_size):
+                dst.write(remap(*[src.read(1, window=window) for src in sources]), 1, window=window)
+    finally:
+        for src in sources:
+            src.close()
+
+# Functions for initial stock rasters ----------------------------------------
+class InitialStockLUT:
+    """
+    State attribute values stored in a dense array indexed by
+    [stock, origin, state_class, forest_type_group, age]. Each key is
+    mapped to its array position by direct integer indexing into a
+    position vector; cells whose keys are not in the table get NaN.
+    """
+
+    key_columns = ["state_class", "forest_type_group", "age"]
+
+    def __init__(self, values, stocks, origins, offsets, positions, no_data=-9999):
+        self.values = values
+        self.stocks = list(stocks)
+        self.origins = list(origins)
+        self.offsets = offsets
+        self.positions = positions
+        self.no_data = no_data
+        self._stock_index = {s: i for i, s in enumerate(self.stocks)}
+        self._origin_index = {o: i for i, o in enumerate(self.origins)}
+
+    def cell_index(self, state_class, forest_type_group, age):
+        """
+        Find the array positions of raster cells. Returns one index array
+        per key and a mask of the cells whose keys are all in the table.
+        """
+        index = []
+        for cells, offset, position in zip([state_class, forest_type_group, age],
+                                           self.offsets, self.positions):
+            cells = np.where(np.isfinite(cells), cells, self.no_data).astype(np.int64) - offset
+            inside = (cells >= 0) & (cells < len(position))
+            index.append(np.where(inside, position[np.clip(cells, 0, len(position) - 1)], -1))
+        found = (index[0] >= 0) & (index[1] >= 0) & (index[2] >= 0)
+        return [np.where(found, i, 0) for i in index], found
+
+    def lookup(self, stock, origin, index, found):
+        """Return the values of a stock and origin for indexed cells."""
+        values = self.values[self._stock_index[stock], self._origin_index[origin]]
+        return np.where(found, values[index[0], index[1], index[2]], np.nan)
+
+def build_initial_stock_lut(sav_lookup, stocks, origins=["fire", "harvest"], no_data=-9999):
+    """
+    Compile state attribute values into an InitialStockLUT
+
+    Parameters
+    ----------
+    sav_lookup : pandas.DataFrame
+        State attribute values with StateAttributeTypeID, origin,
+        state_class, forest_type_group, age and Value columns
+    stocks : list
+        State attribute types to include
+    origins : list
+        Disturbance origins to include
+    no_data : int
+        Key for missing state classes, forest type groups and ages, and
+        value for rows without a Value
+
+    Returns
+    -------
+    InitialStockLUT
+    """
+    sav_lookup = sav_lookup[sav_lookup.StateAttributeTypeID.isin(stocks)
+                            & sav_lookup.origin.isin(origins)]
+    keys = sav_lookup[InitialStockLUT.key_columns].astype(float).fillna(no_data)
+    keys = keys.to_numpy().astype(np.int64)
+
+    offsets, positions, index = [], [], []
+    for k in keys.T:
+        unique_keys = np.unique(k)
+        position = np.full(unique_keys[-1] - unique_keys[0] + 1, -1, dtype=np.int64)
+        position[unique_keys - unique_keys[0]] = np.arange(len(unique_keys))
+        offsets.append(unique_keys[0])
+        positions.append(position)
+        index.append(position[k - unique_keys[0]])
+
+    values = np.full([len(stocks), len(origins)] + [p.max() + 1 for p in positions], np.nan)
+    stock_index = sav_lookup.StateAttributeTypeID.map({s: i for i, s in enumerate(stocks)})
+    origin_index = sav_lookup.origin.map({o: i for i, o in enumerate(origins)})
+    # Rows without a value get no_data, so that they stay apart from cells
+    # that have no row
+    values[stock_index.to_numpy(), origin_index.to_numpy(), index[0], index[1], index[2]] = \
+        sav_lookup.Value.fillna(no_data).to_numpy()
+
+    return InitialStockLUT(values, stocks, origins, offsets, positions, no_data)
+
+def disturbance_origin_flags(tst_fire, tst_harvest, no_data=-9999):
+    """
+    Flag whether the most recent disturbance of each cell was fire or
+    harvest. Ties go to harvest; cells with neither are not flagged.
+
+    Parameters
+    ----------
+    tst_fire : numpy.ndarray
+        Time since fire
+    tst_harvest : numpy.ndarray
+        Time since cut
+
+    Returns
+    -------
+    fire, harvest : numpy.ndarray
+        1 where that origin applies, else 0
+    """
+    has_fire = np.isfinite(tst_fire) & (tst_fire != no_data)
+    has_harvest = np.isfinite(tst_harvest) & (tst_harvest != no_data)
+    harvest = has_harvest & (~has_fire | (tst_harvest <= tst_fire))
+    fire = has_fire & (~has_harvest | (tst_fire < tst_harvest))
+    return fire.astype(np.float64), harvest.astype(np.float64)
+
+def initial_stock_values(lut, stock, index, found, fire, harvest, state_class,
+                         forest_state_classes, no_data=-9999):
+    """
+    Compute initial stock values for raster cells. Cells take the value of
+    their most recent disturbance origin, the fire value when undisturbed,
+    0 when there is no value and no_data outside forest state classes.
+
+    Parameters
+    ----------
+    lut : InitialStockLUT
+        Compiled state attribute values
+    stock : str
+        State attribute type
+    index, found :
+        Cell positions from InitialStockLUT.cell_index
+    fire, harvest : numpy.ndarray
+        Disturbance flags from disturbance_origin_flags
+    state_class : numpy.ndarray
+        State class IDs
+    forest_state_classes : list
+        State class IDs that hold carbon stocks
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    no_disturbance = lut.lookup(stock, "fire", index, found)
+    value = no_disturbance * fire + lut.lookup(stock, "harvest", index, found) * harvest
+    value = np.where(value == 0, no_disturbance, value)
+    value = np.where(np.isnan(value), 0, value)
+    return np.where(np.isin(state_class, forest_state_classes), value, no_data)
+
+def stock_raster_profile(profile, block_size=256):
+    """
+    Rasterio profile for stock rasters: tiled and DEFLATE compressed, as
+    float32 with the floating point predictor.
+    """
+    return dict(profile, tiled=True, blockxsize=block_size, blockysize=block_size,
+                compress="deflate", dtype=rio.float32, predictor=3)
+
+def write_stock_raster(filepath, values, profile):
+    """
+    Write one stock raster.
+
+    Parameters
+    ----------
+    filepath : str
+        Output raster path
+    values : numpy.ndarray
+        2D array of stock values, no_data where missing
+    profile : dict
+        Rasterio profile from stock_raster_profile
+
+    Returns
+    -------
+    None
+    """
+    with rio.open(filepath, "w", **profile) as dst:
+        dst.write(values.astype(np.float32), 1)
+
+def write_stock_rasters(stock_rasters, compute_values, profile,
+                        max_workers=STOCK_RASTER_MAX_WORKERS):
+    """
+    Compute and write stock rasters a few at a time on a thread pool.
+    GDAL releases the GIL while encoding and writing, so rasters compress
+    in parallel. Each worker holds the full-size arrays of one raster, so
+    peak memory grows with max_workers.
+
+    Parameters
+    ----------
+    stock_rasters : dict
+        Output raster path to state attribute type
+    compute_values : function
+        Takes a state attribute type and returns its 2D array of values
+    profile : dict
+        Rasterio profile of the source rasters
+    max_workers : int
+        Number of rasters computed and written at once
+
+    Returns
+    -------
+    None
+    """
+    profile = stock_raster_profile(profile)
+
+    def write(filepath):
+        write_stock_raster(filepath, compute_values(stock_rasters[filepath]), profile)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [executor.submit(write, filepath) for filepath in stock_rasters]:
+            future.result()
+
+def write_initial_stock_rasters_by_block(lut, stock_rasters, raster_paths, profile,
+                                         forest_state_classes, no_data=-9999,
+                                         block_size=512, max_workers=None):
+    """
+    Write initial stock rasters one block at a time. Blocks of the input
+    rasters are read and computed on a thread pool and written to all stock
+    rasters as they finish, so memory use depends on the block size and
+    number of workers rather than on the size of the rasters.
+
+    Parameters
+    ----------
+    lut : InitialStockLUT
+        Compiled state attribute values
+    stock_rasters : dict
+        Output raster path to state attribute type
+    raster_paths : dict
+        Paths of the aligned state_class, forest_type_group, age, tst_fire
+        and tst_harvest rasters
+    profile : dict
+        Rasterio profile of the source rasters
+    forest_state_classes : list
+        State class IDs that hold carbon stocks
+    no_data : int
+        No data value
+    block_size : int
+        Block width and height in cells; a multiple of 16
+    max_workers : int
+        Number of blocks computed at once. Defaults to the number of cores
+
+    Returns
+    -------
+    None
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    profile = stock_raster_profile(profile, block_size=block_size)
+
+    # Rasterio datasets can not be shared between threads
+    local = threading.local()
+    sources = []
+    sources_lock = threading.Lock()
+
+    def compute_block(window):
+        if not hasattr(local, "sources"):
+            local.sources = {k: rio.open(p) for k, p in raster_paths.items()}
+            with sources_lock:
+                sources.extend(local.sources.values())
+        cells = {k: src.read(1, window=window) for k, src in local.sources.items()}
+        index, found = lut.cell_index(cells["state_class"], cells["forest_type_group"], cells["age"])
+        fire, harvest = disturbance_origin_flags(cells["tst_fire"], cells["tst_harvest"], no_data)
+        return window, {filepath: initial_stock_values(lut, stock, index, found, fire, harvest,
+                                                       cells["state_class"], forest_state_classes,
+                                                       no_data).astype(np.float32)
+                        for filepath, stock in stock_rasters.items()}
+
+    windows = list(raster_windows(profile["width"], profile["height"], block_size))
+    destinations = {filepath: rio.open(filepath, "w", **profile) for filepath in stock_rasters}
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Only keep a few blocks per worker in memory at once
+            for start in range(0, len(windows), 2 * max_workers):
+                for window, values in executor.map(compute_block,
+                                                   windows[start:start + 2 * max_workers]):
+                    for filepath, dst in destinations.items():
+                        dst.write(values[filepath], 1, window=window)
+    finally:
+        for dst in destinations.values():
+            dst.close()
+        for src in sources:
+            src.close()
@@ -0,0 +1,237 @@
+## a269
+## ApexRMS
+## October 2026
+##
+## This script runs the numbered Carbon scripts as a workflow. Each stage
+## declares the files and libraries it reads and writes; stages are skipped
+## when their outputs are newer than their inputs, and stages that do not
+## depend on each other run at the same time in separate processes.
+## Stage timings are appended to workflow-timings.csv in the intermediates
+## folder.
+
+## Workspace ----
+# Set up environment
+import os
+import sys
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Load paths to retrieve constants
+cwd = os.getcwd()
+root_dir = cwd.split(r"nestweb")[0] + "nestweb"
+
+# Set working directory
+os.chdir(os.path.join(root_dir, "Scripts/Carbon"))
+
+# Add Scripts directory to path
+sys.path.append(os.path.join(root_dir, "Scripts"))
+
+# Import constants/global variables
+from constants import *
+
+import pandas as pd
+
+# Set local variables
+forceRebuild = False # Set to True to run every stage even if it is up to date
+dryRun = False # Set to True to only list the stages that would run
+targetStages = None # Set to a list of stage names to only bring those (and their inputs) up to date
+maxWorkers = os.cpu_count()
+
+script_dir = os.getcwd()
+stamp_dir = os.path.join(CUSTOM_INTERMEDIATES_DIR, "Workflow")
+timings_file = os.path.join(CUSTOM_INTERMEDIATES_DIR, "workflow-timings.csv")
+
+spinup_library = os.path.join(LIBRARY_DIR, LIBRARY_FILE_NAME_BARE_LAND_SPINUP)
+lulc_library = os.path.join(LIBRARY_DIR, LIBRARY_CARBON_LULC_FILE_NAME)
+working_lulc_library = os.path.join(LIBRARY_DIR, "Working", LIBRARY_CARBON_LULC_FILE_NAME)
+forest_groups_file = os.path.join(CUSTOM_CARBON_DATA_DIR, "nestweb_to_cbm_forest_groups.csv")
+tertiary_stratum_raster = os.path.join(MODEL_INPUTS_DIR, "Spatial", "tertiary-stratum.tif")
+def spinup_subscenarios(*datasheetNames):
+    return [os.path.join(CUSTOM_CARBON_SUB_CBM_SPINUP_DIR, name) for name in datasheetNames]
+
+#%%
+## Stages ----
+# Each stage lists the stages that must run before it, the files and folders
+# it reads and the files and folders it writes. The script, helper functions
+# and constants are inputs of every stage.
+stages = {
+    "1-load-definitions": {
+        "after": [],
+        "inputs": [CUSTOM_CARBON_CBM_DATA_DIR],
+        "outputs": [CUSTOM_DEF_CBM_SPINUP_DIR]},
+    "2-create-cbmcfs3-subscenarios": {
+        "after": ["1-load-definitions"],
+        "inputs": [CUSTOM_CARBON_CBM_DATA_DIR, CUSTOM_DEF_CBM_SPINUP_DIR, forest_groups_file],
+        "outputs": spinup_subscenarios("stsimcbmcfs3_CrosswalkStock",
+                                       "stsimcbmcfs3_CrosswalkSpecies",
+                                       "stsimcbmcfs3_CrosswalkDisturbance")},
+    "2-create-sf-subscenarios": {
+        "after": ["1-load-definitions"],
+        "inputs": [CUSTOM_CARBON_CBM_DATA_DIR, CUSTOM_DEF_CBM_SPINUP_DIR],
+        "outputs": spinup_subscenarios("stsimsf_FlowPathwayDiagram", "stsimsf_FlowPathway",
+                                       "stsimsf_InitialStockNonSpatial", "stsimsf_OutputOptions",
+                                       "stsimsf_StockTypeGroupMembership",
+                                       "stsimsf_FlowTypeGroupMembership")},
+    "2-create-stsim-subscenarios": {
+        "after": ["1-load-definitions"],
+        "inputs": [CUSTOM_DEF_CBM_SPINUP_DIR],
+        "outputs": spinup_subscenarios("stsim_RunControl")},
+    "3-build-spinup-library": {
+        "after": ["2-create-cbmcfs3-subscenarios", "2-create-sf-subscenarios",
+                  "2-create-stsim-subscenarios"],
+        "inputs": [CUSTOM_DEF_CBM_SPINUP_DIR, CUSTOM_CARBON_SUB_CBM_SPINUP_DIR],
+        "outputs": [spinup_library]},
+    "4-run-spinup-scenarios": {
+        "after": ["3-build-spinup-library"],
+        "inputs": [spinup_library, CONUS_CARBON_CBM_OUTPUT_DIR],
+        "outputs": [spinup_library]},
+    "5-extract-results": {
+        "after": ["4-run-spinup-scenarios"],
+        "inputs": [spinup_library, CONUS_CARBON_CBM_OUTPUT_DIR, forest_groups_file],
+        "outputs": [CUSTOM_MERGED_SUBSCENARIOS_DIR]},
+    # Works on the LULC libraries only, so runs alongside the spinup stages.
+    # It saves the tertiary stratum to the Working LULC library.
+    "6-prepare-tertiary-stratum-raster": {
+        "after": [],
+        "inputs": [working_lulc_library, forest_groups_file],
+        "outputs": [tertiary_stratum_raster, working_lulc_library]},
+    "7-insert-carbon-params": {
+        "after": ["5-extract-results", "6-prepare-tertiary-stratum-raster"],
+        "inputs": [lulc_library, CUSTOM_CARBON_DATASHEET_DIR, CUSTOM_MERGED_SUBSCENARIOS_DIR,
+                   forest_groups_file, tertiary_stratum_raster,
+                   os.path.join(MODEL_INPUTS_DIR, "Spatial", "time-since-fire.tif"),
+                   os.path.join(MODEL_INPUTS_DIR, "Spatial", "time-since-cut.tif")],
+        "outputs": [lulc_library, os.path.join(CUSTOM_MERGED_SUBSCENARIOS_DIR,
+                                               "stsimsf_InitialStockSpatial")]},
+    "8-run-updated-carbon-model": {
+        "after": ["7-insert-carbon-params"],
+        "inputs": [os.path.join(LIBRARY_DIR, "Working", "Test", LIBRARY_CARBON_LULC_FILE_NAME)],
+        "outputs": []},
+    "9-create-maps-charts": {
+        "after": ["8-run-updated-carbon-model"],
+        "inputs": [os.path.join(CUSTOM_CARBON_DATA_DIR, "corestime_Charts.csv"),
+                   os.path.join(CUSTOM_CARBON_DATA_DIR, "corestime_Maps.csv")],
+        "outputs": []}}
+
+#%%
+## Functions ----
+def file_times(path):
+    """Return the modification times of a file or of the files in a folder."""
+    if os.path.isfile(path):
+        return [os.path.getmtime(path)]
+    times = []
+    for folder, _, filenames in os.walk(path):
+        times += [os.path.getmtime(os.path.join(folder, f)) for f in filenames]
+    return times
+
+def stamp_file(name):
+    return os.path.join(stamp_dir, name + ".done")
+
+def is_up_to_date(name, rerun):
+    """
+    A stage is up to date when it has finished before, all of its outputs
+    exist, and nothing it reads, nor any stage before it, has changed since.
+    """
+    stage = stages[name]
+    stamp = stamp_file(name)
+    if not os.path.exists(stamp) or any(rerun.get(before) for before in stage["after"]):
+        return False
+    if any(not file_times(path) for path in stage["outputs"]):
+        return False
+    inputs = stage["inputs"] + [os.path.join(script_dir, name + ".py"),
+                                os.path.join(script_dir, "helper_functions.py"),
+                                os.path.join(script_dir, "constants.py")] \
+        + [stamp_file(before) for before in stage["after"]]
+    newest_input = max([t for path in inputs for t in file_times(path)], default=0)
+    return os.path.getmtime(stamp) >= newest_input
+
+def required_stages(targets):
+    """Return the targets and every stage they depend on."""
+    required = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in required:
+            required.add(name)
+            pending += stages[name]["after"]
+    return required
+
+def run_stage(name):
+    """
+    Run a stage script in its own Python process. The stage's stamp is
+    removed first and only written again if the script succeeds, so a
+    stage that fails, or is stopped part way, is run again next time.
+    """
+    if os.path.exists(stamp_file(name)):
+        os.remove(stamp_file(name))
+    start = time.time()
+    out = subprocess.run([sys.executable, name + ".py"], cwd=script_dir,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    with open(os.path.join(stamp_dir, name + ".log"), "w") as f:
+        f.write(out.stdout)
+    if out.returncode == 0:
+        with open(stamp_file(name), "w") as f:
+            f.write(time.ctime() + "\n")
+    return {"Stage": name, "Start": pd.Timestamp(start, unit="s"),
+            "Seconds": time.time() - start,
+            "Status": "done" if out.returncode == 0 else "failed"}
+
+#%%
+## Run ----
+if not os.path.exists(stamp_dir):
+    os.makedirs(stamp_dir)
+
+selected = required_stages(targetStages or list(stages))
+remaining = [name for name in stages if name in selected]
+rerun = {}
+results = []
+running = {}
+workflow_start = time.time()
+
+with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+    while remaining or running:
+        # Start every stage whose earlier stages have finished
+        for name in list(remaining):
+            befores = [b for b in stages[name]["after"] if b in selected]
+            if any(b in remaining or b in running.values() for b in befores):
+                continue
+            remaining.remove(name)
+            if any(rerun.get(b) is None for b in befores):
+                results.append({"Stage": name, "Start": pd.NaT, "Seconds": 0.0,
+                                "Status": "not run (earlier stage failed)"})
+                rerun[name] = None
+            elif not forceRebuild and is_up_to_date(name, rerun):
+                results.append({"Stage": name, "Start": pd.NaT, "Seconds": 0.0,
+                                "Status": "up to date"})
+                rerun[name] = False
+            elif dryRun:
+                results.append({"Stage": name, "Start": pd.NaT, "Seconds": 0.0,
+                                "Status": "would run"})
+                rerun[name] = True
+            else:
+                print("Running " + name, flush=True)
+                running[executor.submit(run_stage, name)] = name
+
+        if not running:
+            continue
+        finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for future in finished:
+            name = running.pop(future)
+            result = future.result()
+            results.append(result)
+            rerun[name] = True if result["Status"] == "done" else None
+            print(name + " " + result["Status"] + " in %.1f s" % result["Seconds"], flush=True)
+            if result["Status"] == "failed":
+                print("  see " + os.path.join(stamp_dir, name + ".log"), flush=True)
+
+results = pd.DataFrame(results)
+print(results[["Stage", "Status", "Seconds"]].to_string(index=False, float_format="%.1f"))
+print("Workflow finished in %.1f s" % (time.time() - workflow_start))
+
+ran = results[results.Status.isin(["done", "failed"])]
+if not ran.empty:
+    ran.to_csv(timings_file, mode="a", index=False, header=not os.path.exists(timings_file))
+
+if (results.Status == "failed").any():
+    sys.exit(1)
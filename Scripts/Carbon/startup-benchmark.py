@@ -0,0 +1,57 @@
+## a269
+## ApexRMS
+## October 2026
+##
+## This script times the imports of each numbered Carbon script,
+## including helper_functions and constants, in a fresh Python
+## process. Run it from Scripts/Carbon to check startup time.
+
+## Workspace ----
+# Set up environment
+import ast
+import glob
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+n_runs = 5
+
+#%%
+def import_statements(filepath):
+    """Return the top-level import statements of a script."""
+    with open(filepath, encoding="utf-8") as f:
+        source = f.read()
+    tree = ast.parse(source)
+    return [ast.get_source_segment(source, node) for node in tree.body
+            if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+def time_imports(statements):
+    """Run import statements in a fresh process and return the seconds taken."""
+    code = "import time\nstart = time.perf_counter()\n" + "\n".join(statements) \
+        + "\nprint(time.perf_counter() - start)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=script_dir,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1])
+    return float(out.stdout.strip().splitlines()[-1])
+
+#%%
+## Benchmark ----
+results = {"Script": [], "Mean (s)": [], "Min (s)": [], "Error": []}
+for filepath in sorted(glob.glob(os.path.join(script_dir, "[0-9]*.py"))):
+    results["Script"].append(os.path.basename(filepath))
+    try:
+        times = [time_imports(import_statements(filepath)) for _ in range(n_runs)]
+        results["Mean (s)"].append(np.mean(times))
+        results["Min (s)"].append(np.min(times))
+        results["Error"].append("")
+    except RuntimeError as e:
+        results["Mean (s)"].append(np.nan)
+        results["Min (s)"].append(np.nan)
+        results["Error"].append(str(e))
+
+print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
@@ -0,0 +1,7 @@
+# Tests for the carbon helper functions. Run from a nestweb checkout with
+#   python -m pytest Scripts/Carbon/tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
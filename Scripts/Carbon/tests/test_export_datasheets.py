@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import helper_functions as hf
+
+DATASHEETS = {
+    "strings": pd.DataFrame({
+        "Name": ["Forest", "a,b", 'say "hi"', "c\rd", "e\nf", "g\r\nh", "", "  padded", None],
+        "ID": range(9)}),
+    "one column": pd.DataFrame({"Name": ["Forest", "", None]}),
+    "numbers": pd.DataFrame({
+        "Amount": [1.5, np.nan, 1e-12, -0.0, 1e20],
+        "ID": pd.array([1, None, 3, 4, 5], dtype="Int64"),
+        "IsAuto": [True, False, True, False, True]}),
+    "header": pd.DataFrame({"a,b": [1], 'say "hi"': [2]}),
+    "empty": pd.DataFrame({"Name": [], "ID": []}),
+    "mixed": pd.DataFrame({"Value": [1, "Forest", 2.5]}),
+}
+
+@pytest.mark.parametrize("name", DATASHEETS)
+def test_write_csv_matches_pandas(name, tmp_path):
+    datasheet = DATASHEETS[name]
+    datasheet.to_csv(tmp_path / "pandas.csv", index=False, float_format="%.10f")
+    hf.write_csv(datasheet, str(tmp_path / "columnar.csv"))
+    assert (tmp_path / "columnar.csv").read_bytes() == (tmp_path / "pandas.csv").read_bytes()
+
+def test_export_error_raised_by_wait(tmp_path):
+    datasheet = pd.DataFrame({"Name": ["Forest"]})
+    # A directory in place of the csv makes the export fail
+    os.makedirs(tmp_path / "stsim_StateClass.csv")
+    hf.export_datasheets("stsim_StateClass", datasheet, folder=str(tmp_path), parquet=False)
+    with pytest.raises(OSError):
+        hf.wait_for_exports()
+    hf.wait_for_exports()
+
+def test_read_datasheet_prefers_edited_csv(tmp_path):
+    pytest.importorskip("pyarrow")
+    filepath = str(tmp_path / "stsim_StateClass.csv")
+    hf.export_datasheets("stsim_StateClass", pd.DataFrame({"Name": ["Forest"]}),
+                         folder=str(tmp_path), parquet=True)
+    hf.wait_for_exports()
+    assert hf.read_datasheet(filepath)["Name"].tolist() == ["Forest"]
+
+    # An edit that keeps the csv older than the Parquet copy
+    parquet_time = os.stat(str(tmp_path / "stsim_StateClass.parquet")).st_mtime_ns
+    pd.DataFrame({"Name": ["Wetland"]}).to_csv(filepath, index=False)
+    os.utime(filepath, ns=(parquet_time - 10**9, parquet_time - 10**9))
+    assert hf.read_datasheet(filepath)["Name"].tolist() == ["Wetland"]
@@ -0,0 +1,61 @@
+import subprocess
+import types
+
+import pandas as pd
+import pytest
+
+import helper_functions as hf
+
+# Output of SyncroSim.Console.exe --list --library --tree, in the layout
+# pysyncrosim parses: one item per line, indented three characters per
+# level, with "*" around items shown as read-only
+LIBRARY_TREE = "\r\n".join([
+    "Library [0]: Carbon Spinup.ssim",
+    "+- Project [1]: Definitions",
+    "   +- Folder [3]: Subscenarios",
+    "   |  +- Folder [4]: 03 Initial Conditions",
+    "   |  |  +- *Folder* [2]: Landscape",
+    "   |  |  +- Scenario [11]: Initial Conditions: Base",
+    "   |  +- Scenario [12]: Run Control: Non-spatial, 300 yr, 1 MC",
+    "   +- Folder [5]: Landscape Scenarios",
+    "   |  +- Folder [6]: Landscape",
+    "   +- Scenario [13]: Pipeline - Load CBM-CFS3 Output",
+    ""])
+
+# --list --folders lists folders by id, so a child can come before its parent
+LIBRARY_FOLDERS = pd.DataFrame({
+    "Id": [2, 3, 4, 5, 6],
+    "Name": ["Landscape", "Subscenarios", "03 Initial Conditions",
+             "Landscape Scenarios", "Landscape"]})
+
+@pytest.fixture
+def registry(monkeypatch):
+    def run(command, **kwargs):
+        assert "--tree" in command
+        return subprocess.CompletedProcess(command, 0, LIBRARY_TREE.encode("utf-8"))
+
+    monkeypatch.setattr(hf.subprocess, "run", run)
+    monkeypatch.setattr(hf, "list_folders_in_library", lambda session, library: LIBRARY_FOLDERS)
+    return hf.FolderRegistry(types.SimpleNamespace(location="SyncroSim"),
+                             types.SimpleNamespace(location="Carbon Spinup.ssim"))
+
+def test_parents_from_tree(registry):
+    assert registry.parents == {"2": "4", "3": None, "4": "3", "5": None, "6": "5"}
+
+def test_scenario_folders_from_tree(registry):
+    assert registry.scenario_folders == {"11": "4", "12": "3"}
+
+def test_child_listed_before_parent(registry):
+    assert registry.by_path["Subscenarios/03 Initial Conditions/Landscape"] == "2"
+    assert registry.get("Landscape Scenarios/Landscape") == "6"
+
+def test_get_by_name(registry):
+    assert registry.get("03 Initial Conditions") == "4"
+    with pytest.raises(KeyError):
+        registry.get("Landscape")
+    with pytest.raises(KeyError):
+        registry.get("Missing")
+
+def test_add_nested_folder(registry):
+    registry.add(7, "Single Cell", 4)
+    assert registry.get("Subscenarios/03 Initial Conditions/Single Cell") == "7"
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+import helper_functions as hf
+
+def test_missing_values_are_no_data():
+    sav_lookup = pd.DataFrame({
+        "StateAttributeTypeID": ["Carbon: Merchantable"] * 4,
+        "origin": ["fire", "harvest", "fire", "harvest"],
+        "state_class": [40, 40, 41, 41],
+        "forest_type_group": [1, 1, 1, 1],
+        "age": [10, 10, 10, 10],
+        "Value": [np.nan, 5, 3, np.nan]})
+    lut = hf.build_initial_stock_lut(sav_lookup, ["Carbon: Merchantable"])
+
+    # Harvest, fire and undisturbed cells of both state classes, then a
+    # cell with no row and a cell outside the forest state classes
+    state_class = np.array([40, 40, 40, 41, 41, 41, 42, 1], dtype=float)
+    forest_type_group = np.ones(8)
+    age = np.full(8, 10.0)
+    tst_fire = np.array([-9999, 5, -9999, 5, -9999, -9999, 5, 5], dtype=float)
+    tst_harvest = np.array([5, -9999, -9999, -9999, 5, -9999, -9999, -9999], dtype=float)
+
+    index, found = lut.cell_index(state_class, forest_type_group, age)
+    fire, harvest = hf.disturbance_origin_flags(tst_fire, tst_harvest)
+    values = hf.initial_stock_values(lut, "Carbon: Merchantable", index, found,
+                                     fire, harvest, state_class, [40, 41, 42])
+
+    np.testing.assert_array_equal(values, [5, -9999, -9999, 3, -9999, 3, 0, -9999])
@@ -0,0 +1,72 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import helper_functions as hf
+
+@pytest.fixture
+def library(tmp_path):
+    """A small SQLite database laid out like a SyncroSim library."""
+    path = str(tmp_path / "library.ssim")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE core_DistributionType (DistributionTypeID INTEGER PRIMARY KEY,
+            ProjectID INTEGER, Name TEXT);
+        CREATE TABLE stsim_StateClass (StateClassID INTEGER PRIMARY KEY,
+            ProjectID INTEGER, Name TEXT);
+        CREATE TABLE stsimsf_StockGroup (StockGroupID INTEGER PRIMARY KEY,
+            ProjectID INTEGER, Name TEXT);
+        CREATE TABLE stsim_Transition (TransitionID INTEGER PRIMARY KEY,
+            ScenarioID INTEGER, FromStateClassID INTEGER,
+            TransferToStateClassID INTEGER, DistributionType INTEGER,
+            Probability DOUBLE);
+        CREATE TABLE stsimsf_OutputStock (OutputStockID INTEGER PRIMARY KEY,
+            ScenarioID INTEGER, Timestep INTEGER, StateClassID INTEGER,
+            StockGroupID INTEGER, Amount DOUBLE);
+        INSERT INTO core_DistributionType VALUES (1, 1, 'Normal');
+        INSERT INTO stsim_StateClass VALUES (10, 1, 'Forest:All'), (11, 1, 'Wetland:All');
+        INSERT INTO stsimsf_StockGroup VALUES (20, 1, 'Total Carbon');
+        INSERT INTO stsim_Transition VALUES (1, 5, 10, 11, 1, 0.5), (2, 5, 11, NULL, NULL, 1.0);
+        INSERT INTO stsimsf_OutputStock VALUES
+            (1, 5, 2000, 10, 20, 1.5), (2, 5, 2001, 10, 20, 2.5),
+            (3, 5, 2001, 11, 20, 3.5), (4, 6, 2001, 10, 20, 4.5);
+    """)
+    connection.commit()
+    connection.close()
+    return path
+
+def test_name_table(library):
+    with hf.LibraryReader(library) as reader:
+        assert reader.name_table("stsim_Transition", "FromStateClassID") == "stsim_StateClass"
+        assert reader.name_table("stsim_Transition", "TransferToStateClassID") == "stsim_StateClass"
+        assert reader.name_table("stsim_Transition", "DistributionType") == "core_DistributionType"
+        assert reader.name_table("stsim_Transition", "Probability") is None
+        assert reader.name_table("stsim_Transition", "ScenarioID") is None
+
+def test_read_names(library):
+    with hf.LibraryReader(library) as reader:
+        data = reader.read("stsim_Transition", scenario_id=5)
+    assert list(data.columns) == ["FromStateClassID", "TransferToStateClassID",
+                                  "DistributionType", "Probability"]
+    assert data["FromStateClassID"].tolist() == ["Forest:All", "Wetland:All"]
+    assert data["TransferToStateClassID"].iloc[0] == "Wetland:All"
+    assert pd.isna(data["TransferToStateClassID"].iloc[1])
+    assert data["DistributionType"].iloc[0] == "Normal"
+
+def test_read_filters(library):
+    with hf.LibraryReader(library) as reader:
+        data = reader.read("stsimsf_OutputStock", scenario_id=5,
+                           columns=["StateClassID", "Amount"],
+                           where={"Timestep": 2001, "StateClassID": "Forest:All"})
+        ids = reader.read("stsimsf_OutputStock", scenario_id=[5, 6],
+                          columns=["Timestep", "StateClassID"], where={"Timestep": 2001},
+                          names=False)
+    assert data.to_dict("list") == {"StateClassID": ["Forest:All"], "Amount": [2.5]}
+    assert str(ids["StateClassID"].dtype) == "Int64"
+    assert ids["StateClassID"].tolist() == [10, 11, 10]
+
+def test_read_unknown_column(library):
+    with hf.LibraryReader(library) as reader:
+        with pytest.raises(KeyError):
+            reader.read("stsimsf_OutputStock", columns=["Missing"])
@@ -0,0 +1,109 @@
+## a269
+## ApexRMS
+## October 2026
+##
+## This script times generate_transition_types against the previous
+## element-by-element implementation for increasing numbers of state
+## classes, and checks that both give the same transition types. Run it
+## from Scripts/Carbon. The previous implementation wrote through chained
+## assignment, which does nothing in pandas 3, so the copy here assigns
+## with .iloc[row, column] instead; the element-by-element loop is kept.
+
+## Workspace ----
+# Set up environment
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(script_dir)
+os.chdir(script_dir)
+
+from helper_functions import generate_transition_types
+
+n_runs = 3
+n_classes = [10, 50, 100, 200, 500, 1000, 2000]
+max_loop_classes = 200 # The previous implementation takes minutes beyond this
+
+#%%
+def generate_transition_types_loop(stateClasses):
+  """Previous implementation of generate_transition_types, for comparison."""
+  srcClassesWetland = stateClasses[stateClasses['StateLabelXID'] == 'Wetland']
+  srcClassesWetland['srcName'] = "Wetland:" + srcClassesWetland['StateLabelYID']
+  srcClassesWetland['srcID'] = srcClassesWetland['ID']
+
+  srcClassesOther = stateClasses[stateClasses['StateLabelXID'] != 'Wetland']
+  srcClassesOther['srcName'] = srcClassesOther['StateLabelXID']
+  srcClassesOther['srcID'] = srcClassesOther['ID']
+
+  srcClasses = pd.concat([srcClassesWetland, srcClassesOther])
+  srcClasses.rename(columns={'StateLabelXID': 'srcClass'}, inplace=True)
+  srcClasses = srcClasses[['srcClass', 'srcName', 'srcID']]
+
+  nrows = len(srcClasses)
+  transitionTypes = srcClasses.loc[srcClasses.index.repeat(nrows)]
+  transitionTypes['destClass'] = ""
+  transitionTypes['destName'] = ""
+  transitionTypes['destID'] = np.nan
+  destColumns = [transitionTypes.columns.get_loc(c) for c in ['destClass', 'destName', 'destID']]
+
+  for i in range(0, nrows):
+    for j in range(0, nrows):
+        row = ((i - 1) * nrows) + j
+        transitionTypes.iloc[row, destColumns[0]] = srcClasses.iloc[j]['srcClass']
+        transitionTypes.iloc[row, destColumns[1]] = srcClasses.iloc[j]['srcName']
+        transitionTypes.iloc[row, destColumns[2]] = int(srcClasses.iloc[j]['srcID'])
+
+  transitionTypes['destID'] = transitionTypes['destID'].astype(int)
+  transitionTypes = transitionTypes[transitionTypes['srcID'] != transitionTypes['destID']]
+  transitionTypes['Name'] = transitionTypes['srcName'] + "->" + transitionTypes['destName']
+  transitionTypes['ID'] = (transitionTypes['srcID'].astype(str) + transitionTypes['destID'].astype(str)).astype(int)
+
+  return transitionTypes[['Name', 'ID']]
+
+def make_state_classes(n):
+    """Return n state classes, a quarter of them wetlands, with ids 1 to n."""
+    ids = np.arange(1, n + 1)
+    wetland = ids % 4 == 0
+    return pd.DataFrame({
+        "StateLabelXID": np.where(wetland, "Wetland", "Class " + pd.Series(ids).astype(str)),
+        "StateLabelYID": np.where(wetland, "Subclass " + pd.Series(ids).astype(str), "All"),
+        "ID": ids})
+
+def time_function(function, stateClasses):
+    """Return the fastest of n_runs calls and the result of the last call."""
+    times = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        result = function(stateClasses)
+        times.append(time.perf_counter() - start)
+    return np.min(times), result
+
+#%%
+## Benchmark ----
+warnings.simplefilter("ignore")
+results = {"State classes": [], "Transition types": [], "Vectorized (s)": [],
+           "Loop (s)": [], "Speedup": [], "Same": [], "Error": []}
+for n in n_classes:
+    stateClasses = make_state_classes(n)
+    vectorized_time, vectorized = time_function(generate_transition_types, stateClasses)
+    loop_time, same, error = np.nan, "", ""
+    if n <= max_loop_classes:
+        try:
+            loop_time, loop = time_function(generate_transition_types_loop, stateClasses)
+            same = vectorized.reset_index(drop=True).equals(loop.reset_index(drop=True))
+        except Exception as e:
+            error = type(e).__name__ + ": " + str(e)
+    results["State classes"].append(n)
+    results["Transition types"].append(len(vectorized))
+    results["Vectorized (s)"].append(vectorized_time)
+    results["Loop (s)"].append(loop_time)
+    results["Speedup"].append(loop_time / vectorized_time)
+    results["Same"].append(same)
+    results["Error"].append(error)
+
+print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))